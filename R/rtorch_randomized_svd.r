@@ -6,10 +6,11 @@
 #' @param q_iter Integer. Number of power iterations to perform
 #' @param device Character. Either "CPU" or "GPU depending on what user selects and availability
 #' @param cores Integer. Number of CPU cores to use for matrix operations
+#' @param orthonormalizer Character. One of "qr", "tsqr", "cholqr2", or "lu". See [FastPCA()].
 #'
 #' @returns a list with U, S, and Vh
 #'
-rtorch_randomized_svd = function(A_mat, k, p, q_iter, device = "CPU", cores = 1){
+rtorch_randomized_svd = function(A_mat, k, p, q_iter, device = "CPU", cores = 1, orthonormalizer = "qr"){
   #accuracy
   dtype = "float64"
   #set device and cores
@@ -35,12 +36,12 @@ rtorch_randomized_svd = function(A_mat, k, p, q_iter, device = "CPU", cores = 1)
 
   #subspace
   Y = A$matmul(Omega)
-  for(i in seq(q_iter)){
-    Q = torch::linalg_qr(torch::torch_transpose(A, 1, 2)$matmul(Y))[[1]]
-    Y = torch::linalg_qr(A$matmul(Q))[[1]]
+  for(i in seq_len(q_iter)){
+    Q = rtorch_orthonormalize(torch::torch_transpose(A, 1, 2)$matmul(Y), orthonormalizer, final = FALSE)
+    Y = rtorch_orthonormalize(A$matmul(Q), orthonormalizer, final = FALSE)
   }
   #orthonormalize
-  Q = torch::linalg_qr(Y)[[1]]
+  Q = rtorch_orthonormalize(Y, orthonormalizer)
   #project A
   B = torch::torch_transpose(Q, 1, 2)$matmul(A)
   #calculate the svd of smaller dimension
@@ -56,3 +57,59 @@ rtorch_randomized_svd = function(A_mat, k, p, q_iter, device = "CPU", cores = 1)
               S = S[1:k],
               Vh = Vh[1:k,]))
 }
+
+#' Orthonormal basis for the range of a tall torch tensor
+#'
+#' @param Y torch tensor (m x b)
+#' @param method Character. One of "qr", "tsqr", "cholqr2", or "lu"
+#' @param final Boolean. Whether the basis is used for the final projection and so must be orthonormal ("lu" then uses QR)
+#' @param block_rows Integer. Rows per block for "tsqr"
+#'
+#' @returns torch tensor (m x b)
+#'
+rtorch_orthonormalize = function(Y, method = "qr", final = TRUE, block_rows = NULL){
+  m = dim(Y)[1]
+  b = dim(Y)[2]
+  if(method == "lu" && final) method = "qr"
+  if(method == "qr") return(torch::linalg_qr(Y)[[1]])
+
+  if(method == "tsqr"){
+    if(is.null(block_rows)) block_rows = ceiling(m / torch::torch_get_num_threads())
+    n_blocks = min(m %/% max(block_rows, 4 * b), m %/% (4 * b))
+    if(n_blocks < 2) return(torch::linalg_qr(Y)[[1]])
+    #factor each block of rows, then reduce the stacked R factors with one small QR
+    edges = floor(seq(0, m, length.out = n_blocks + 1))
+    factors = lapply(seq_len(n_blocks), function(i) torch::linalg_qr(Y[(edges[i] + 1):edges[i + 1], ]))
+    Q2 = torch::linalg_qr(torch::torch_cat(lapply(factors, `[[`, 2), dim = 1))[[1]]
+    blocks = lapply(seq_len(n_blocks), function(i) factors[[i]][[1]]$matmul(Q2[((i - 1) * b + 1):(i * b), ]))
+    return(torch::torch_cat(blocks, dim = 1))
+  }
+
+  if(method == "cholqr2"){
+    Q = Y
+    for(i in 1:2){
+      chol = torch::linalg_cholesky_ex(torch::torch_transpose(Q, 1, 2)$matmul(Q))
+      #not positive definite: too ill-conditioned for CholeskyQR
+      if(chol[[2]]$item() != 0) return(torch::linalg_qr(Y)[[1]])
+      #Q = Q %*% solve(t(L)), solved as L %*% t(Q_new) = t(Q)
+      Q = torch::torch_transpose(torch::torch_triangular_solve(torch::torch_transpose(Q, 1, 2), chol[[1]], upper = FALSE)[[1]], 1, 2)
+    }
+    return(Q)
+  }
+
+  if(method == "lu"){
+    lu = torch::torch_lu(Y)
+    L = torch::torch_tril(lu[[1]], diagonal = -1) + torch::torch_eye(m, b, dtype = Y$dtype, device = Y$device)
+    #apply the row swaps as a permutation instead of building the m x m P
+    perm = seq_len(m)
+    pivots = as.integer(as.array(lu[[2]]$cpu()))
+    for(i in seq_along(pivots)){
+      j = pivots[i]
+      tmp = perm[i]
+      perm[i] = perm[j]
+      perm[j] = tmp
+    }
+    return(L[order(perm), ])
+  }
+  stop("Unknown orthonormalizer: ", method)
+}
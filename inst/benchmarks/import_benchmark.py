@@ -0,0 +1,95 @@
+"""
+Startup benchmark for the Python side of FastPCA.
+
+For every backend this records, each in a fresh interpreter:
+  cold:   time to import the backend's modules (what the first call in an R session pays)
+  cached: time to import them again in the same interpreter (every later call with the module cache)
+  rerun:  time to re-execute the module files with runpy (what `reticulate::py_run_file` used to pay per call)
+
+Usage:
+    python import_benchmark.py [--repeats 5] [--output import_times.json]
+
+The output format follows the extension (.json or .csv); without --output JSON is printed.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+
+PY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "python"))
+
+#modules loaded by each backend; third party packages imported lazily inside functions are listed too
+BACKENDS = {
+    "pytorch": ["torch_svd_func", "torch_svd_func_exact", "torch_transform", "torch_transform_svd",
+                "torch_svd_incremental", "torch_pca_model"],
+    "umap": ["umap_func", "umap"],
+    "tinygrad": ["tinygrad_backends", "tinygrad_transform", "tinygrad_svd_func"],
+}
+
+_CHILD = r"""
+import importlib, json, os, runpy, sys, time
+sys.path.insert(0, {py_dir!r})
+modules = {modules!r}
+t0 = time.perf_counter()
+for m in modules:
+    importlib.import_module(m)
+cold = time.perf_counter() - t0
+t0 = time.perf_counter()
+for m in modules:
+    importlib.import_module(m)
+cached = time.perf_counter() - t0
+t0 = time.perf_counter()
+for m in modules:
+    path = os.path.join({py_dir!r}, m + ".py")
+    if os.path.exists(path):
+        runpy.run_path(path)
+rerun = time.perf_counter() - t0
+print(json.dumps(dict(cold=cold, cached=cached, rerun=rerun)))
+"""
+
+def time_backend(modules, repeats):
+    """
+    Runs the import timings for one backend in `repeats` fresh interpreters.
+
+    Returns:
+        A list of dicts with cold/cached/rerun seconds, or a single dict with an error.
+    """
+    code = _CHILD.format(py_dir=PY_DIR, modules=modules)
+    runs = []
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if proc.returncode != 0:
+            return [dict(error=proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed")]
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    rows = []
+    for backend in args.backends:
+        for i, run in enumerate(time_backend(BACKENDS[backend], args.repeats)):
+            rows.append(dict(backend=backend, repeat=i, python=platform.python_version(), **run))
+            print(backend, run, file=sys.stderr)
+
+    if args.output is None:
+        print(json.dumps(rows, indent=2))
+    elif args.output.endswith(".csv"):
+        fields = ["backend", "repeat", "python", "cold", "cached", "rerun", "error"]
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
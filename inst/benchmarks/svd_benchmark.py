@@ -0,0 +1,258 @@
+"""
+Benchmark suite for the Python SVD backends.
+
+Generates synthetic low-rank-plus-noise matrices (tall, wide, square, sparse) with a fixed
+seed, runs every backend on the CPU and records per run:
+  time_s        wall time of the SVD call
+  peak_rss_mb   peak resident memory of the process during the call
+  base_rss_mb   resident memory just before the call (the matrix itself and imports)
+  call_rss_mb   peak_rss_mb - base_rss_mb, the memory the call itself added
+  sv_rel_error  max_i |S_i - S*_i| / S*_i over the leading k singular values
+  angle_u/v     largest principal angle (radians) between the leading k left/right singular
+                subspaces and those of an exact reference (numpy LAPACK SVD)
+
+Every matrix is generated once in the parent and saved to a temporary file; each (shape, backend)
+pair then runs in a fresh process that only loads it, so peak RSS is not polluted by earlier
+runs or by the generation. On Linux the peak is also reset right before the call. Backends
+without sparse support get the densified matrix. Results go to a JSON or CSV file (by
+extension) so runs can be diffed for regressions.
+
+Usage:
+    python svd_benchmark.py --output svd_benchmark.json
+    python svd_benchmark.py --shapes tall sparse --backends randomized tsolve_stream --size 0.25
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "python"))
+
+#rows, columns and density (None for dense) at --size 1
+SHAPES = {
+    "tall": (20_000, 500, None),
+    "wide": (500, 20_000, None),
+    "square": (3_000, 3_000, None),
+    "sparse": (20_000, 2_000, 0.02),
+}
+
+BACKENDS = ["randomized", "tsolve_stream", "exact", "tinygrad"]
+#backends that take a scipy.sparse matrix as it is; the others get it densified
+SPARSE_BACKENDS = {"randomized"}
+
+def make_matrix(shape: str, size: float = 1.0, rank: int = 50, noise: float = 1e-2, seed: int = 42):
+    """
+    Builds a reproducible low-rank-plus-noise test matrix.
+
+    Dense shapes are U diag(s) V^T + noise * G with geometrically decaying s and orthonormal
+    U, V. The sparse shape is U_s diag(s) V_s^T + noise * G_s with sparse factors U_s, V_s
+    (unit-norm columns, each entry kept with probability about sqrt(density / rank), so the
+    product has roughly `density` nonzeros) and noise on a further density / 10 of the entries,
+    so it is sparse and still of rank `rank` plus noise (scipy CSR).
+
+    Args:
+        shape: One of SHAPES.
+        size: Multiplier applied to both dimensions.
+        rank: Rank of the signal part.
+        noise: Standard deviation of the Gaussian noise, relative to the smallest signal value.
+        seed: Random seed.
+
+    Returns:
+        A NumPy array or scipy.sparse CSR matrix.
+    """
+    m, n, density = SHAPES[shape]
+    m, n = max(int(m * size), 2), max(int(n * size), 2)
+    rank = min(rank, m, n)
+    rng = np.random.default_rng(seed)
+    s = 10.0 ** np.linspace(2, 0, rank)
+    if density is None:
+        Uq, _ = np.linalg.qr(rng.standard_normal((m, rank)))
+        Vq, _ = np.linalg.qr(rng.standard_normal((n, rank)))
+        A = (Uq * s) @ Vq.T
+        A += noise * rng.standard_normal((m, n))
+        return A
+    import scipy.sparse as sp
+    #P(entry != 0) = 1 - (1 - d^2)^rank for factor density d
+    d = min(1.0, np.sqrt(-np.log1p(-density) / rank))
+    def factor(rows):
+        F = sp.random(rows, rank, density=d, format="csc", random_state=rng, data_rvs=rng.standard_normal)
+        norms = np.sqrt(np.asarray(F.multiply(F).sum(axis=0))).ravel()
+        return F @ sp.diags(1.0 / np.where(norms > 0, norms, 1.0))
+    U_s, V_s = factor(m), factor(n)
+    G = sp.random(m, n, density=density / 10, format="csr", random_state=rng, data_rvs=rng.standard_normal)
+    return ((U_s @ sp.diags(s)) @ V_s.T + noise * G).tocsr()
+
+def _save_matrix(A, path):
+    #dense as .npy, sparse as scipy .npz; returns the path written
+    if isinstance(A, np.ndarray):
+        path += ".npy"
+        np.save(path, A)
+    else:
+        import scipy.sparse as sp
+        path += ".npz"
+        sp.save_npz(path, A)
+    return path
+
+def _load_matrix(path, dense=False):
+    if path.endswith(".npy"):
+        return np.load(path)
+    import scipy.sparse as sp
+    A = sp.load_npz(path)
+    return A.toarray() if dense else A.tocsr()
+
+def _load_backend(name):
+    sys.path.insert(0, PY_DIR)
+    if name == "randomized":
+        from torch_svd_func import randomized_svd_py
+        return lambda A, k, p, q, cores: randomized_svd_py(A, k=k, p=p, q_iter=q, cores=cores)
+    if name == "tsolve_stream":
+        from torch_svd_func_optim1 import randomized_svd_tsolve_stream
+        return lambda A, k, p, q, cores: randomized_svd_tsolve_stream(A, k=k, p=p, q_iter=q, cores=cores)
+    if name == "exact":
+        from torch_svd_func_exact import exact_svd_py
+        return lambda A, k, p, q, cores: exact_svd_py(A, cores=cores)
+    if name == "tinygrad":
+        from tinygrad_svd_func import randomized_svd_py_tg
+        return lambda A, k, p, q, cores: randomized_svd_py_tg(A, k=k, p=p, q_iter=q, cores=cores)
+    raise ValueError(f"unknown backend: {name}")
+
+def _max_angle(X, Y):
+    #largest principal angle between the column spaces of two orthonormal bases
+    cos = np.linalg.svd(X.T @ Y, compute_uv=False)
+    return float(np.arccos(np.clip(cos.min(), -1.0, 1.0)))
+
+def _rss_mb():
+    #ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2) if sys.platform == "darwin" else peak / 1024
+
+def _proc_status_mb(key):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) / 1024 for line in f if line.startswith(key))
+
+def _reset_peak():
+    #Linux: writing 5 to clear_refs resets VmHWM to the current RSS; True when it worked
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _current_rss_mb():
+    try:
+        return _proc_status_mb("VmRSS:")
+    except (OSError, StopIteration):
+        return _rss_mb()
+
+def _peak_rss_mb(reset):
+    if reset:
+        try:
+            return _proc_status_mb("VmHWM:")
+        except (OSError, StopIteration):
+            pass
+    return _rss_mb()
+
+def _run_one(backend, matrix_path, k, p, q_iter, cores, ref_path, queue):
+    #child process: load the matrix, run one backend, compare with the reference
+    try:
+        fn = _load_backend(backend)
+        A = _load_matrix(matrix_path, dense=backend not in SPARSE_BACKENDS)
+        reset = _reset_peak()
+        base = _current_rss_mb()
+        t0 = time.perf_counter()
+        U, S, Vh = fn(A, k, p, q_iter, cores)
+        elapsed = time.perf_counter() - t0
+        #without a reset (not Linux) the peak can predate the call, at most by the loaded matrix
+        peak = _peak_rss_mb(reset)
+        ref = np.load(ref_path)
+        U, S, V = np.asarray(U)[:, :k], np.asarray(S)[:k], np.asarray(Vh)[:k].T
+        queue.put(dict(time_s=elapsed, peak_rss_mb=peak, base_rss_mb=base, call_rss_mb=max(peak - base, 0.0),
+                       sv_rel_error=float(np.max(np.abs(S - ref["S"]) / ref["S"])),
+                       angle_u=_max_angle(U, ref["U"]), angle_v=_max_angle(V, ref["V"])))
+    except Exception as e:
+        queue.put(dict(error=f"{type(e).__name__}: {e}"))
+
+def run_benchmark(shapes, backends, size=1.0, k=20, p=10, q_iter=2, cores=4, repeats=1, timeout=None):
+    """
+    Runs every backend on every shape, each in its own process.
+
+    Returns:
+        List of result dicts, one per (shape, backend, repeat).
+    """
+    ctx = mp.get_context("spawn")
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for shape in shapes:
+            A = make_matrix(shape, size)
+            matrix_path = _save_matrix(A, os.path.join(tmp, f"{shape}_matrix"))
+            dense = A if isinstance(A, np.ndarray) else A.toarray()
+            U, S, Vh = np.linalg.svd(dense, full_matrices=False)
+            ref_path = os.path.join(tmp, f"{shape}_ref.npz")
+            np.savez(ref_path, U=U[:, :k], S=S[:k], V=Vh[:k].T)
+            info = dict(shape=shape, m=A.shape[0], n=A.shape[1], sparse=not isinstance(A, np.ndarray), k=k, p=p, q_iter=q_iter)
+            del A, dense, U, S, Vh
+            for backend in backends:
+                for r in range(repeats):
+                    queue = ctx.Queue()
+                    proc = ctx.Process(target=_run_one, args=(backend, matrix_path, k, p, q_iter, cores, ref_path, queue))
+                    proc.start()
+                    proc.join(timeout)
+                    if proc.is_alive():
+                        proc.terminate()
+                        proc.join()
+                        result = dict(error=f"timed out after {timeout}s")
+                    else:
+                        result = queue.get() if not queue.empty() else dict(error=f"exit code {proc.exitcode}")
+                    row = dict(info, backend=backend, repeat=r, **result)
+                    rows.append(row)
+                    print(json.dumps(row), file=sys.stderr)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shapes", nargs="+", default=list(SHAPES), choices=list(SHAPES))
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--size", type=float, default=1.0, help="multiplier for the matrix dimensions")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--p", type=int, default=10)
+    parser.add_argument("--q_iter", type=int, default=2)
+    parser.add_argument("--cores", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=None, help="seconds before a run is abandoned")
+    parser.add_argument("--output", default=None, help=".json or .csv file (default: JSON on stdout)")
+    args = parser.parse_args()
+
+    rows = run_benchmark(args.shapes, args.backends, size=args.size, k=args.k, p=args.p, q_iter=args.q_iter,
+                         cores=args.cores, repeats=args.repeats, timeout=args.timeout)
+    meta = dict(python=platform.python_version(), platform=platform.platform(), cpu_count=os.cpu_count(),
+                numpy=np.__version__, args=vars(args))
+    try:
+        import torch
+        meta["torch"] = torch.__version__
+    except ImportError:
+        pass
+
+    if args.output is None:
+        print(json.dumps(dict(meta=meta, results=rows), indent=2))
+    elif args.output.endswith(".csv"):
+        fields = ["shape", "m", "n", "sparse", "k", "p", "q_iter", "backend", "repeat", "time_s", "peak_rss_mb",
+                  "base_rss_mb", "call_rss_mb", "sv_rel_error", "angle_u", "angle_v", "error"]
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(dict(meta=meta, results=rows), f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,160 @@
+
+import json
+import os
+import time
 import numpy as np
 from tinygrad.tensor import Tensor
 from tinygrad.device import Device
+from tinygrad import dtypes
 
-def list_available_devices():
-    available = []
-    test_arr = np.ones((1,1), np.float32)
-    devices = [d for d in Device._devices if d != "WEBGPU"]
-    for dev in devices:
+#runtimes that are not compute devices, and the PYTHON emulator (only used when selected with DEV=PYTHON)
+_SKIP = {"WEBGPU", "NULL", "NPY", "DISK", "TINYFS", "RDMA", "PYTHON"}
+#host devices, "CPU" in the R interface
+_HOST = {"CPU", "CLANG", "LLVM", "PYTHON"}
+
+#device name -> capabilities, computed once per process by device_registry()
+_registry = None
+
+def _tinygrad_version():
+    try:
+        from importlib.metadata import version
+        return version("tinygrad")
+    except Exception:
+        return None
+
+def _host_memory():
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _supports(dev: str, dtype) -> bool:
+    #a realized matmul checks the allocator, the compiler and the result
+    try:
+        x = Tensor(np.ones((4, 4)), dtype = dtype, device = dev)
+        return bool(np.allclose((x @ x).numpy(), 4))
+    except Exception:
+        return False
+
+def _matmul_gflops(dev: str, dtype, max_size: int = 512, min_time: float = 0.01) -> float:
+    #doubles the size until a matmul takes min_time, so slow devices are not stuck on a large product
+    size, gflops = 32, 0.0
+    rng = np.random.default_rng(0)
+    while True:
+        a = Tensor(rng.standard_normal((size, size)), dtype = dtype, device = dev).realize()
+        (a @ a).realize()
+        t0 = time.perf_counter()
+        (a @ a).numpy()
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+        gflops = 2 * size ** 3 / elapsed / 1e9
+        if elapsed >= min_time or size >= max_size:
+            return gflops
+        size *= 2
+
+def probe_device(dev: str) -> dict:
+    """
+    Probes one tinygrad device.
+
+    Args:
+        dev: tinygrad device name (e.g. "CUDA", "METAL", "CPU").
+
+    Returns:
+        Dict with float64/float32 support, matmul throughput (GFLOP/s, in the widest supported
+        float dtype) and available memory in bytes (None when tinygrad cannot report it), or
+        None if the device cannot allocate and compute.
+    """
+    float32 = _supports(dev, dtypes.float32)
+    if not float32:
+        return None
+    float64 = _supports(dev, dtypes.float64)
+    return dict(name = dev, float64 = float64, float32 = float32,
+                gflops = _matmul_gflops(dev, dtypes.float64 if float64 else dtypes.float32),
+                memory_bytes = _host_memory() if dev in _HOST else None)
+
+def device_registry(refresh: bool = False, cache_path: str = None) -> dict:
+    """
+    Capabilities of every usable tinygrad device, probed once per process.
+
+    With `cache_path` (or the FASTPCA_TINYGRAD_DEVICES environment variable) the registry is also
+    read from / written to a JSON file, so later processes skip the probing. The file is ignored
+    when it was written by another tinygrad version.
+
+    Args:
+        refresh: Whether to probe again even if a registry is cached.
+        cache_path: Optional path of the JSON file.
+
+    Returns:
+        Dict of device name -> dict from `probe_device`.
+    """
+    global _registry
+    if _registry is not None and not refresh:
+        return _registry
+    cache_path = cache_path or os.environ.get("FASTPCA_TINYGRAD_DEVICES")
+    if cache_path and not refresh and os.path.exists(cache_path):
         try:
-            _ = Tensor(test_arr, device=dev).realize()  #try to allocate + realize
-            available.append(dev)
-        except Exception as e:
-            # print(f"{dev} failed: {e}")   #
+            with open(cache_path) as f:
+                saved = json.load(f)
+            if saved.get("tinygrad") == _tinygrad_version():
+                _registry = saved["devices"]
+                return _registry
+        except (OSError, ValueError, KeyError):
             pass
-    # "CPU" is an alias to CLANG 
+    candidates = [d for d in Device._devices if d not in _SKIP]
+    if os.environ.get("DEV", "").upper() == "PYTHON":
+        candidates.append("PYTHON")
+    _registry = {}
+    for dev in candidates:
+        info = probe_device(dev)
+        if info is not None:
+            _registry[dev] = info
+    if cache_path:
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(dict(tinygrad = _tinygrad_version(), devices = _registry), f, indent = 2)
+        except OSError as e:
+            print(f"Could not write the tinygrad device registry to {cache_path}: {e}")
+    return _registry
+
+def select_device(device: str = "auto", precision: str = "auto"):
+    """
+    Picks a tinygrad device and float dtype from the registry.
+
+    Args:
+        device: "CPU" (fastest host device), "GPU" (fastest accelerator), "auto" (fastest of all)
+                or a tinygrad device name.
+        precision: "auto" (float64 when the device supports it, else float32 with a warning),
+                   "float64" or "float32".
+
+    Returns:
+        Tuple of (device name, tinygrad dtype).
+    """
+    registry = device_registry()
+    if not registry:
+        raise RuntimeError("no usable tinygrad device")
+    device = device.upper()
+    if device == "CPU":
+        names = [d for d in registry if d in _HOST]
+    elif device == "GPU":
+        names = [d for d in registry if d not in _HOST]
+    elif device == "AUTO":
+        names = list(registry)
+    else:
+        names = [d for d in registry if d == device]
+    if not names:
+        raise RuntimeError(f"no usable tinygrad device for '{device}'; available: {', '.join(registry)}")
+    best = max(names, key = lambda d: registry[d]["gflops"])
+    if precision == "float32":
+        return best, dtypes.float32
+    if registry[best]["float64"]:
+        return best, dtypes.float64
+    if precision == "float64":
+        raise RuntimeError(f"tinygrad device {best} does not support float64")
+    print(f"WARNING: {best} does not support 64-bit floats, values are converted to 32-bit. Precision will be lost.")
+    return best, dtypes.float32
+
+def list_available_devices():
+    available = list(device_registry())
+    # "CPU" is an alias to CLANG
     if "CLANG" in available and "CPU" not in available:
         available.append("CPU")
     return available
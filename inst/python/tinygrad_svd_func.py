@@ -3,8 +3,10 @@ import numpy as np
 import gc
 import os
 import math
+import functools
 from tinygrad.tensor import Tensor
 from tinygrad import dtypes
+from tinygrad_backends import select_device
 
 def randomized_svd_py_tg(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2, device: str = "cpu", cores: int = 2):
     """
@@ -16,8 +18,8 @@ def randomized_svd_py_tg(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2,
         k:    
         p:    
         q_iter: 
-        device: 
-        core: 
+        device: "CPU", "GPU" or "auto" (fastest device, see tinygrad_backends.select_device).
+        cores: 
 
     Returns:
         NumPy arrays for the transformed data.
@@ -29,17 +31,9 @@ def randomized_svd_py_tg(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2,
       os.environ["OPENBLAS_NUM_THREADS"] = str(cores)
       os.environ["VECLIB_MAXIMUM_THREADS"] = str(cores)
     
-    #becuase for some reason Apple doesn't support 64bit with metal?
-    if device != "CPU":
-      tinygrad.device.Device.DEFAULT = "GPU"
-      if "METAL" in tinygrad.device.Device._devices:
-        A = Tensor(A_np, dtype = tinygrad.dtypes.float32).to("GPU")
-        print("WARNING: Apple requires values to be 32-bit for GPU. Precision will be lost.")
-      else:
-        A = Tensor(A_np).to("GPU")
-    else:
-      A = Tensor(A_np).to("CPU")
-      tinygrad.device.Device.DEFAULT = "CPU"
+    #fastest device of the requested kind and the widest float it supports (Metal has no float64)
+    device, dtype = select_device(device)
+    A = Tensor(A_np, dtype = dtype, device = device)
       
     #A is now on the device
     #prep power calculations
@@ -76,71 +70,221 @@ def randomized_svd_py_tg(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2,
     #return
     return U.numpy(), S.numpy(), Vh.numpy()
 
-def qr_acs(self) -> tuple[Tensor, Tensor]:
+#TinyJit kernels for qr_acs, one set per (shape, dtype, device) so repeated QRs of the same
+#shape (every power iteration of the range finder) replay the captured kernels. A replay writes
+#into the same output buffers every time, so each kernel has two instances used alternately and
+#the output of one call is never the input buffer of the next
+_qr_kernels = {}
+
+def _householder_step(P: Tensor, V: Tensor, T: Tensor, i: Tensor, g: Tensor):
+  #one column of a panel: P (..., m, nb) panel, V (..., m, nb) Householder vectors so far,
+  #T (..., nb, nb) compact WY factor, i the column within the panel and g the diagonal row.
+  #columns and rows are selected with masks so every call has the same shapes
+  m, nb = P.shape[-2], P.shape[-1]
+  e_col = (Tensor.arange(nb).to(P.device).reshape(nb, 1) == i).cast(P.dtype)
+  rows = Tensor.arange(m).to(P.device).reshape(m, 1)
+  e_row = (rows == g).cast(P.dtype)
+  below = (rows >= g).cast(P.dtype)
+  x = (P @ e_col) * below
+  alpha = (x * e_row).sum(-2, keepdim = True)
+  norm = x.square().sum(-2, keepdim = True).sqrt()
+  s = (alpha >= 0).where(alpha.const_like(-1), alpha.const_like(1))
+  u1 = alpha - s * norm
+  nonzero = u1 != 0
+  #a zero column gets tau = 0 (H = I)
+  v = (x / nonzero.where(u1, u1.const_like(1))) * (1 - e_row) + e_row
+  tau = nonzero.where(-s * u1 / nonzero.where(norm, norm.const_like(1)), u1.const_like(0))
+  P = P - (v * tau) @ (v.transpose(-2, -1) @ P)
+  #T <- [[T, -tau T V^T v], [0, tau]]
+  z = (T @ (V.transpose(-2, -1) @ v)) * -tau + tau * e_col
+  T = T + z @ e_col.transpose(-2, -1)
+  V = V + v @ e_col.transpose(-2, -1)
+  return P.realize(), V.realize(), T.realize()
+
+def _apply_block_transpose(R: Tensor, V: Tensor, T: Tensor):
+  #(I - V T V^T)^T R
+  return (R - V @ (T.transpose(-2, -1) @ (V.transpose(-2, -1) @ R))).realize()
+
+def _apply_block(Q: Tensor, V: Tensor, T: Tensor):
+  #(I - V T V^T) Q
+  return (Q - V @ (T @ (V.transpose(-2, -1) @ Q))).realize()
+
+def qr_acs(self, mode: str = "reduced", block_size: int = 32) -> tuple[Tensor, Tensor]:
+  """
+  Blocked Householder QR with compact WY updates.
+
+  Columns are factored a panel of `block_size` at a time. Within a panel each Householder
+  reflector only touches the (m x block_size) panel, and the panel's reflectors are collected
+  as I - V T V^T and applied to the rest of the matrix with three matrix products. Q is never
+  formed as m x m for mode "reduced": the block reflectors are applied to the first min(m, n)
+  columns of the identity. The per-column and per-block kernels run through TinyJit, so their
+  graphs are built once per shape rather than for every column.
+
+  Args:
+    self: Tensor (..., m, n).
+    mode: "reduced" for Q (..., m, k) and R (..., k, n) with k = min(m, n), or "complete" for
+          Q (..., m, m) and R (..., m, n).
+    block_size: Panel width.
+
+  Returns:
+    Tuple of (Q, R).
+  """
+  from tinygrad import TinyJit
   assert self.ndim > 1, f"expected two or more dimensions, got {self.ndim}"
-  R = self.clone()
-  b_shape, m, n = self.shape[0:self.ndim - 2], int(R.shape[-2]), int(R.shape[-1])
-  Q = Tensor.eye(m, dtype = self.dtype, device = self.device).reshape((1,) * (len(self.shape) - 2) + 2 * (m,)).expand(b_shape + 2 * (m,)).contiguous()
-  for i in range(int(min(m, n))):
-    x = R[..., i:m, i]
-    s = -x[..., 0].sign()
-    u1 = x[..., 0] - s * x.square().sum(-1).sqrt()
-    w = x.unsqueeze(-1) / u1.reshape(b_shape + 2 * (1,))
-    w[..., 0, 0] = 1
-    tau = (-s * u1 / x.square().sum(-1).sqrt()).reshape(b_shape + 2 * (1,)).expand(w.shape)
-    R[..., i:m, :] = R[..., i:m, :] - (w * tau) @ (w.transpose(-2, -1) @ R[..., i:m, :])
-    Q[..., :, i:m] = Q[..., :, i:m] - (Q[..., :, i:m] @ w) @ (tau.transpose(-2, -1) * w.transpose(-2, -1))
-  return Q,R
-
-def svd_acs(self, full_matrices = True) -> tuple[Tensor, Tensor, Tensor]:
-  import math
-  #partial implementation of https://www.netlib.org/lapack/lawnspdf/lawn169.pdf , pg 26
+  assert mode in ("reduced", "complete"), f"unknown mode {mode}"
+  b_shape, m, n = self.shape[0:self.ndim - 2], int(self.shape[-2]), int(self.shape[-1])
+  k = min(m, n)
+  nb = max(1, min(block_size, k))
+  #pad the columns to whole panels; the padded columns are zero and get tau = 0
+  n_pad = -(-max(n, k) // nb) * nb
+  R = self.pad(((0, 0),) * (self.ndim - 2) + ((0, 0), (0, n_pad - n))).contiguous().realize()
+  q_cols = k if mode == "reduced" else m
+  key = (b_shape, m, n_pad, nb, q_cols, self.dtype, self.device)
+  if key not in _qr_kernels:
+    _qr_kernels[key] = tuple((TinyJit(f), TinyJit(f)) for f in (_householder_step, _apply_block_transpose, _apply_block))
+  step, apply_r, apply_q = _qr_kernels[key]
+
+  blocks = []
+  for p, j0 in enumerate(range(0, k, nb)):
+    P = R[..., j0:j0 + nb].contiguous().realize()
+    V = Tensor.zeros(*b_shape, m, nb, dtype = self.dtype, device = self.device).contiguous().realize()
+    T = Tensor.zeros(*b_shape, nb, nb, dtype = self.dtype, device = self.device).contiguous().realize()
+    for i in range(min(nb, k - j0)):
+      P, V, T = step[i % 2](P, V, T, Tensor([[i]], device = self.device).realize(), Tensor([[j0 + i]], device = self.device).realize())
+    #reflectors are zero above their diagonal row, so applying them to all of R leaves the finished columns unchanged
+    R = apply_r[p % 2](R, V, T)
+    #V and T live in the step kernels' output buffers, keep a copy for Q
+    blocks.append((V.clone().realize(), T.clone().realize()))
+
+  #thin Q = H_1 ... H_p I[:, :q_cols]
+  Q = Tensor.eye(m, q_cols, dtype = self.dtype).to(self.device).reshape((1,) * len(b_shape) + (m, q_cols)).expand(b_shape + (m, q_cols)).clone().realize()
+  for p, (V, T) in enumerate(reversed(blocks)):
+    Q = apply_q[p % 2](Q, V, T)
+  #the results must not alias buffers the next qr_acs call of this shape will overwrite
+  R = R[..., 0:q_cols if mode == "complete" else k, 0:n].triu().contiguous().realize()
+  return Q.clone().realize(), R
+
+#TinyJit kernels for svd_acs, keyed like _qr_kernels
+_jacobi_kernels = {}
+
+def _jacobi_rounds(U: Tensor, V: Tensor, off: Tensor, rounds: int):
+  #a batch of one-sided Jacobi rounds in round-robin order (circle method, first column fixed). The
+  #columns are kept in the arrangement of the current round, where column j is paired with column
+  #num - 1 - j, so a round only slices, flips and concatenates (O(num^2) per round). Between rounds
+  #every column but the first moves one place to the right (the last wraps to position 1); after
+  #num - 1 rounds the columns are back in place. off carries the largest relative inner product
+  #|u_i . u_j| / (|u_i| |u_j|) seen before rotating, the convergence measure of the sweep
+  num = U.shape[-1]
+  h = num // 2
+  for _ in range(rounds):
+    Ul, Ur, Vl, Vr = U[..., :h], U[..., h:].flip(-1), V[..., :h], V[..., h:].flip(-1)
+    gamma = (Ul * Ur).sum(-2, keepdim = True)
+    alpha, beta = Ul.square().sum(-2, keepdim = True), Ur.square().sum(-2, keepdim = True)
+    #pairs that are already orthogonal (or a zero padding column) are not rotated
+    zero = gamma == 0
+    tau = (beta - alpha) / (2 * zero.where(gamma.const_like(1), gamma))
+    t = (tau >= 0).where(tau.const_like(1), tau.const_like(-1)) / (tau.abs() + (1 + tau.square()).sqrt())
+    t = zero.where(t.const_like(0), t)
+    c = 1 / (1 + t.square()).sqrt()
+    s = c * t
+    U = (c * Ul - s * Ur).cat((s * Ul + c * Ur).flip(-1), dim = -1)
+    V = (c * Vl - s * Vr).cat((s * Vl + c * Vr).flip(-1), dim = -1)
+    if num > 2:
+      U = U[..., :1].cat(U[..., num - 1:], U[..., 1:num - 1], dim = -1)
+      V = V[..., :1].cat(V[..., num - 1:], V[..., 1:num - 1], dim = -1)
+    #one buffer per round: fusing the slices of several rounds into one kernel does not compile in tinygrad 0.14
+    U, V = U.contiguous(), V.contiguous()
+    norms = (alpha * beta).sqrt()
+    rel = gamma.abs() / (norms > 0).where(norms, norms.const_like(1))
+    off = off.maximum(rel.max().reshape(1))
+  return U.realize(), V.realize(), off.realize()
+
+def _round_robin_arrangement(num: int, rounds: int) -> np.ndarray:
+  #original column held at each position after `rounds` rounds of _jacobi_rounds
+  arrangement = np.arange(num)
+  if num > 2:
+    shift = rounds % (num - 1)
+    arrangement[1:] = np.roll(arrangement[1:], shift)
+  return arrangement
+
+def svd_acs(self, full_matrices = True, tol: float = None, max_sweeps: int = 30,
+            check_every: int = 1, rounds_per_kernel: int = 8) -> tuple[Tensor, Tensor, Tensor]:
+  """
+  SVD by QR preconditioning followed by one-sided Jacobi on the small triangular factor.
+
+  Partial implementation of https://www.netlib.org/lapack/lawnspdf/lawn169.pdf , pg 26. Rotations
+  are applied in round robin order, num / 2 independent pairs per round, with the pairs brought
+  together by fixed slices rather than permutation products. `rounds_per_kernel`
+  rounds run in one TinyJit kernel, and every `check_every` sweeps (num - 1 rounds each) the
+  largest relative off-diagonal inner product of the sweep is read back; iteration stops as soon
+  as it is below `tol`, instead of running a fixed number of rounds.
+
+  Args:
+    self: Tensor (..., m, n).
+    full_matrices: Whether to return the complete U (or Vh when m < n).
+    tol: Convergence tolerance on max |u_i . u_j| / (|u_i| |u_j|); default sqrt(max(m, n)) * eps.
+    max_sweeps: Upper bound on the number of sweeps.
+    check_every: Sweeps between convergence checks (each check synchronizes with the device).
+    rounds_per_kernel: Rounds batched into one JIT kernel.
+
+  Returns:
+    Tuple of (U, S, Vh).
+  """
+  from tinygrad import TinyJit
   assert self.ndim > 1, f"expected two or more dimensions, got {self.ndim}"
   b_shape, m, n = self.shape[:-2], int(self.shape[-2]), int(self.shape[-1])
   #preprocess the matrix
-  Q, R = (qr_acs(self) if m >= n else qr_acs(self.transpose(-2, -1)))
+  mode = "complete" if full_matrices else "reduced"
+  Q, R = (qr_acs(self, mode = mode) if m >= n else qr_acs(self.transpose(-2, -1), mode = mode))
   num, q_num = int(min(m, n)), int(max(m, n))
-  U = R.shrink(tuple([(0, self.shape[i]) for i in range(self.ndim - 2)] + [(0, num), (0, num)])).contiguous()
-  V = Tensor.eye(num, dtype = self.dtype, device = self.device).reshape((1,) * (self.ndim - 2) + (num, num)).expand(b_shape + 2 * (num,)).contiguous()
-  #prepare round robin pairing
-  permute, inverse_permute = Tensor.arange(0, num, dtype = dtypes.int, device = self.device), Tensor.zeros(num, dtype = dtypes.int, device = self.device).contiguous()
-  permute[num//2:num] = permute[num//2:num].flip(0)
-  inverse_permute[permute] = Tensor.arange(num, dtype = dtypes.int, device = self.device)
-  def one_round_jacobi(U, V,permute,inverse_permute):
-    #pair all the columns
-    V_permuted, runoff_V = (V[..., permute].split(num - 1, -1)) if num % 2 == 1 else (V[..., permute], None)
-    V_left, V_right = V_permuted.split(num//2, -1)
-    U_permuted, runoff_U = (U[..., permute].split(num - 1, -1)) if num % 2 == 1 else (U[..., permute], None)
-    U_left, U_right = U_permuted.split(num//2, -1)
-    #compute the jacobi rotations for each pairing
-    gamma = (U_left * U_right).sum(-2).reshape(b_shape + (1, num//2))
-    alpha, beta = U_permuted.square().sum(-2).unsqueeze(-2).split(num//2, -1)
-    tau = (beta - alpha) / (2 * gamma)
-    t = tau.sign() / (tau.abs() + (1 + tau.square()).sqrt())
-    c = 1 / (1 + t.square()).sqrt()
-    s = c * t
-    #apply the rotations
-    U_left, U_right = c * U_left - s * U_right, s * U_left + c * U_right
-    U = U_left.cat(U_right.cat(runoff_U, dim = -1) if num % 2 == 1 else U_right, dim = -1)[..., inverse_permute]
-    V_left, V_right = c * V_left - s * V_right, s * V_left + c * V_right
-    V = V_left.cat(V_right.cat(runoff_V, dim = -1) if num % 2 == 1 else V_right, dim = -1)[..., inverse_permute]
-    #prepare the next round robin pairings
-    if num % 2 == 1: permute = ((permute - 1) % num)
-    else: permute = permute[0].reshape(1).cat(((permute[1:num] - 2) % (num - 1)) + 1)
-    inverse_permute = inverse_permute.scatter(0,permute,Tensor.arange(num,dtype=dtypes.int32, device = self.device))
-    return U.realize(), V.realize(), permute.realize(), inverse_permute.realize()
-  max_iterations, iterations_per_round = 1, int((num) * math.log2(num) * 2 + 2)#sorta heuristic, most use num*log2(num)
-  for _ in range(max_iterations * iterations_per_round): U, V, permute, inverse_permute = one_round_jacobi(U, V, permute, inverse_permute)
+  if tol is None:
+    tol = math.sqrt(q_num) * float(np.finfo(np.float32 if self.dtype == dtypes.float32 else np.float64).eps)
+  #an odd number of columns gets a zero column, which is never rotated, so every round has whole pairs
+  num2 = num + num % 2
+  U = R[..., 0:num, 0:num].pad(((0, 0),) * len(b_shape) + ((0, 0), (0, num2 - num))).contiguous().realize()
+  V = Tensor.eye(num2, dtype = self.dtype).to(self.device).reshape((1,) * len(b_shape) + (num2, num2)).expand(b_shape + (num2, num2)).clone().realize()
+
+  rounds = 0
+  if num2 > 1:
+    #a sweep is num2 - 1 rounds, run in kernels of rounds_per_kernel rounds (the last kernel runs on
+    #into the next sweep, which only rotates again)
+    rpk = max(1, min(rounds_per_kernel, num2 - 1))
+    n_kernels = -(-(num2 - 1) // rpk)
+    key = (b_shape, num, rpk, self.dtype, self.device)
+    if key not in _jacobi_kernels:
+      #two instances used alternately, see _qr_kernels
+      _jacobi_kernels[key] = (TinyJit(functools.partial(_jacobi_rounds, rounds = rpk)),
+                              TinyJit(functools.partial(_jacobi_rounds, rounds = rpk)))
+    kernels = _jacobi_kernels[key]
+    calls = 0
+    for sweep in range(max_sweeps):
+      off = Tensor.zeros(1, dtype = self.dtype, device = self.device).contiguous().realize()
+      for _ in range(n_kernels):
+        U, V, off = kernels[calls % 2](U, V, off)
+        calls += 1
+      if (sweep + 1) % check_every == 0 and off.item() <= tol:
+        break
+    rounds = calls * rpk
+    U, V = U.clone().realize(), V.clone().realize()
+  #positions of the real (not padding) columns in the final arrangement
+  arrangement = _round_robin_arrangement(num2, rounds)
+  real = np.flatnonzero(arrangement < num)
+  U, V = U[..., 0:num, :], V[..., 0:num, :]
+
   #extract singular values and sort. construct U from Q
-  S, indices = U.square().sum(-2).sqrt().sort(dim = -1, descending=True)
-  new_indices = Tensor.arange(num, device = U.device).reshape((1,) * (self.ndim - 1) + (num,)).expand(b_shape + 2 * (num,)).contiguous()
-  new_indices[..., :num] = indices.reshape(b_shape + (1,) + (U.shape[0],)).expand(b_shape + 2 * (num,))
-  U,V = U.gather(-1, new_indices[...,0:num,0:num]) / S.unsqueeze(-2), V.gather(-1, new_indices[..., 0:num, 0:num])
-  
-  padded_u = Tensor.eye(q_num, dtype = U.dtype, device = U.device).reshape((1,) * (self.ndim - 2) + 2 * (q_num,)).expand(b_shape + 2 * (q_num,)).contiguous()
-  padded_u[..., 0:num, 0:num] = U
-  U = Q @ padded_u
-  if not full_matrices: U, V = U[..., 0:num], V[..., 0:num]
+  S = U.square().sum(-2).sqrt()
+  S_np = S.numpy()[..., real]
+  order = real[np.argsort(-S_np, axis = -1, kind = "stable")]
+  idx = Tensor(np.ascontiguousarray(order).astype(np.int32)).to(self.device)
+  S = S.gather(-1, idx)
+  U = U.gather(-1, idx.unsqueeze(-2).expand(U.shape[:-1] + (num,))) / (S > 0).where(S, S.const_like(1)).unsqueeze(-2)
+  V = V.gather(-1, idx.unsqueeze(-2).expand(V.shape[:-1] + (num,)))
+  if full_matrices:
+    #complete Q: the columns beyond num span the orthogonal complement and are kept as they are
+    U = (Q[..., 0:num] @ U).cat(Q[..., num:], dim = -1)
+  else:
+    #thin Q (q_num x num) already has the right shape
+    U = Q @ U
   V = V.realize()
   U = U.realize()
   S = S.realize()
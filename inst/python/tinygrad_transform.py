@@ -2,8 +2,10 @@ import tinygrad
 import numpy as np
 import gc
 import os
+from tinygrad_backends import select_device
 
-def transform_py_tg(A_np: np.ndarray, log2: int = 0, transpose: int = 0, scale: int = 1, cores: int = 2, device: str = "CPU"):
+def transform_py_tg(A_np: np.ndarray, log2: int = 0, transpose: int = 0, scale: int = 1, cores: int = 2, device: str = "CPU",
+                    pseudocount: float = 0, drop_zero_var: int = 0):
     """
     Performs scaling and centering, and transposing the matrix.
 
@@ -13,42 +15,49 @@ def transform_py_tg(A_np: np.ndarray, log2: int = 0, transpose: int = 0, scale:
         log2: integer of 1 or 0 for whether to log transform the data
         transpose: integer of 1 or 0 for whether to tranpose the matrix.
         scale: integer of 1 or 0 for whether to mean center and unit variance transform the data. For whether to scale columns
+        pseudocount: added before the log2 transform so zero counts stay finite.
+        drop_zero_var: integer of 1 or 0 for whether to drop the columns with zero (or non-finite) variance.
 
     Returns:
-        NumPy arrays for the transformed data.
+        NumPy arrays for the transformed data, and the boolean mask of the kept columns with `drop_zero_var`.
     """
-    if device == "CPU":
+    if device.upper() == "CPU":
       os.environ["OMP_NUM_THREADS"] = str(cores)
       os.environ["MKL_NUM_THREADS"] = str(cores)
     
-    #becuase for some reason Apple doesn't support 64bit with metal?
-    if device != "CPU":
-      if "METAL" in tinygrad.device.Device._devices:
-        A = tinygrad.tensor.Tensor(A_np, dtype = tinygrad.dtypes.float32).to("GPU")
-        print("WARNING: Apple requires values to be 32-bit for GPU. Precision will be lost.")
-      else:
-        A = tinygrad.tensor.Tensor(A_np).to("GPU")
-    else:
-      A = tinygrad.tensor.Tensor(A_np).to("CPU")
+    #fastest device of the requested kind and the widest float it supports (Metal has no float64)
+    device, dtype = select_device(device)
+    A = tinygrad.tensor.Tensor(A_np, dtype = dtype, device = device)
       
     
     if log2 == 1:
-      A = A.log2()
+      A = (A + pseudocount).log2() if pseudocount != 0 else A.log2()
       
     if transpose == 1:
       #A = torch.tensor(A).T
       A = A.transpose()
     
-    if scale == 1:
-      #mean center
-      mean_vec = A.mean(axis=0)
-      A = A - mean_vec
-      #scale
-      std_vec = A.std(axis=0)
-      A = A / std_vec
+    keep = None
+    if scale == 1 or drop_zero_var == 1:
+      #one set of column statistics for both the zero-variance mask and the scaling
+      mean_vec, std_vec = A.mean(axis=0), A.std(axis=0)
+      if scale == 1:
+        #dead columns are divided by 1 and dropped below
+        A = (A - mean_vec) / ((std_vec > 0).where(std_vec, 1) if drop_zero_var == 1 else std_vec)
+      #the statistics are realized together with the result, in one schedule
+      A.realize(mean_vec, std_vec)
+      if drop_zero_var == 1:
+        #same rule as torch_transform._live_columns
+        mean_np, std_np = mean_vec.numpy(), std_vec.numpy()
+        keep = np.isfinite(std_np) & (std_np > np.sqrt(np.finfo(std_np.dtype).eps) * np.abs(mean_np))
+        if not keep.all():
+          print(f"Dropping {int((~keep).sum())} zero-variance or non-finite column(s)")
     
     A = A.numpy()
-
+    
+    if keep is not None:
+      #the dead columns are dropped on the host, while copying the result out
+      return (A if keep.all() else A[:, keep]), keep
     return A
 
 # if __name__ == "__main__":
@@ -0,0 +1,100 @@
+import os
+import time
+import torch
+
+#(m, n, b, dtype, device type, memory budget, max threads) -> dict(block_rows, threads), for the life of the process
+_stream_cache = {}
+
+def available_memory(device: torch.device) -> int:
+    """
+    Free memory in bytes on the compute device (free host RAM for the CPU), or None if unknown.
+    """
+    if device.type == "cuda":
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _sync(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+def _time_stream(A_slice: torch.Tensor, Y_slice: torch.Tensor, block_rows: int, repeats: int = 2) -> float:
+    #best wall time of C = Y^T @ A accumulated over the slice in blocks of block_rows, as in the real loop
+    C = torch.zeros((Y_slice.shape[1], A_slice.shape[1]), device=A_slice.device, dtype=Y_slice.dtype)
+    best = float("inf")
+    for _ in range(repeats):
+        C.zero_()
+        _sync(A_slice.device)
+        t0 = time.perf_counter()
+        for i0 in range(0, A_slice.shape[0], block_rows):
+            C.add_(Y_slice[i0:i0 + block_rows].T @ A_slice[i0:i0 + block_rows])
+        _sync(A_slice.device)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+@torch.no_grad()
+def autotune_stream(A: torch.Tensor, b: int, cores: int = 4, memory_budget_mb: float = None,
+                    calib_elements: int = 2 ** 24, verbose: bool = True) -> dict:
+    """
+    Picks `block_rows` and the CPU thread count for the streamed C = Y^T @ A of
+    `randomized_svd_tsolve_stream`.
+
+    A short calibration times the accumulation on a slice of the actual matrix (the first rows
+    of A, at most `calib_elements` entries, with a random Y): first the thread counts (powers of
+    two up to `cores`) at a middle block size, then the block sizes (powers of two) with the
+    fastest thread count. A block of r rows may need r * (n + b) temporary elements (a contiguous
+    copy of the strided row block and of Y), so block sizes above `memory_budget_mb` are never
+    tried. The choice is cached per shape, dtype and device for later calls with the same matrix size.
+
+    Args:
+        A: (m x n) tensor on the compute device.
+        b: Number of columns of Y (k + p).
+        cores: Largest number of CPU threads to consider.
+        memory_budget_mb: Memory allowed for one block; default a quarter of the free memory.
+        calib_elements: Upper bound on the entries of A touched by the calibration.
+        verbose: Whether to print the choice.
+
+    Returns:
+        Dict with `block_rows` and `threads` (None on the GPU). The thread count is left set.
+    """
+    m, n = (int(d) for d in A.shape)
+    device = A.device
+    key = (m, n, b, A.dtype, device.type, memory_budget_mb, cores)
+    if key in _stream_cache:
+        tuned = _stream_cache[key]
+        if tuned["threads"] is not None:
+            torch.set_num_threads(tuned["threads"])
+        return tuned
+
+    itemsize = A.element_size()
+    budget = memory_budget_mb * 2 ** 20 if memory_budget_mb is not None else (available_memory(device) or 2 ** 30) / 4
+    max_rows = max(1, int(budget // ((n + b) * itemsize)))
+    slice_rows = max(1, min(m, calib_elements // max(n, 1)))
+    #powers of two from 256 (or less for small inputs) up to the budget and half the slice, so every candidate streams at least two blocks
+    top = max(1, min(max_rows, slice_rows // 2 if slice_rows > 1 else 1))
+    sizes = [r for r in (2 ** e for e in range(8, 18)) if r <= top] or [top]
+
+    A_slice = A[:slice_rows]
+    Y_slice = torch.randn((slice_rows, b), device=device, dtype=A.dtype)
+
+    threads = None
+    if device.type == "cpu":
+        options = sorted({t for t in (2 ** e for e in range(0, 8)) if t <= cores} | {max(1, cores)})
+        mid = sizes[len(sizes) // 2]
+        times = {}
+        for t in options:
+            torch.set_num_threads(t)
+            times[t] = _time_stream(A_slice, Y_slice, mid)
+        #fewer threads unless more are clearly (5%) faster
+        threads = min(options, key=lambda t: (times[t] * (1 + 0.05 * options.index(t)), t))
+        torch.set_num_threads(threads)
+    block_times = {r: _time_stream(A_slice, Y_slice, r) for r in sizes}
+    block_rows = min(block_times, key=block_times.get)
+
+    tuned = dict(block_rows=block_rows, threads=threads)
+    _stream_cache[key] = tuned
+    if verbose:
+        print(f"Autotuned block_rows = {block_rows}" + ("" if threads is None else f", threads = {threads}"))
+    return tuned
@@ -0,0 +1,177 @@
+import torch
+import numpy as np
+from torch_orth import orthonormalize
+
+# Linear operators used by the randomized SVD when A cannot (or should not) be
+# held as a single dense tensor. Every operator exposes:
+#   shape, dtype, device
+#   matmul(W)  -> A @ W    (m x b)
+#   rmatmul(Y) -> A.T @ Y  (n x b)
+#   frobenius_sq() -> ||A||_F^2 (total sum of squares, used by the adaptive range finder)
+# so the range finder only ever touches A through those two products.
+
+class RowBlockOperator:
+    """
+    Streams a matrix that lives on disk (np.memmap, HDF5/Zarr dataset, ...)
+    through the device in blocks of rows.
+
+    Only one block of rows is ever resident, so a pass over A costs
+    O(block_rows * n) memory on top of the (m x b) / (n x b) products.
+    """
+    def __init__(self, source, block_rows: int = 10_000, device: torch.device = torch.device("cpu"), dtype: torch.dtype = torch.float64):
+        self.source = source
+        self.shape = tuple(int(d) for d in source.shape)
+        if len(self.shape) != 2:
+            raise ValueError(f"expected a 2-dimensional matrix, got shape {self.shape}")
+        self.block_rows = max(1, int(block_rows))
+        self.device = device
+        self.dtype = dtype
+        self.np_dtype = torch.empty(0, dtype=dtype).numpy().dtype
+
+    def blocks(self):
+        m = self.shape[0]
+        for i0 in range(0, m, self.block_rows):
+            i1 = min(i0 + self.block_rows, m)
+            #explicit block copy: read-only memmaps/datasets are never handed to torch directly
+            Ai = np.array(self.source[i0:i1], dtype=self.np_dtype, order="C")
+            yield i0, i1, torch.from_numpy(Ai).to(self.device)
+
+    def matmul(self, W: torch.Tensor) -> torch.Tensor:
+        out = torch.empty((self.shape[0], W.shape[1]), device=self.device, dtype=self.dtype)
+        for i0, i1, Ai in self.blocks():
+            out[i0:i1] = Ai @ W
+        return out
+
+    def rmatmul(self, Y: torch.Tensor) -> torch.Tensor:
+        out = torch.zeros((self.shape[1], Y.shape[1]), device=self.device, dtype=self.dtype)
+        for i0, i1, Ai in self.blocks():
+            out.addmm_(Ai.T, Y[i0:i1])
+        return out
+
+    def frobenius_sq(self) -> float:
+        return sum(torch.linalg.vector_norm(Ai).item() ** 2 for _, _, Ai in self.blocks())
+
+class DenseOperator:
+    """
+    A dense tensor already on the compute device.
+    """
+    def __init__(self, A: torch.Tensor):
+        self.A = A
+        self.shape = tuple(A.shape)
+        self.device = A.device
+        self.dtype = A.dtype
+
+    def matmul(self, W: torch.Tensor) -> torch.Tensor:
+        return self.A @ W
+
+    def rmatmul(self, Y: torch.Tensor) -> torch.Tensor:
+        return self.A.T @ Y
+
+    def frobenius_sq(self) -> float:
+        return torch.linalg.vector_norm(self.A).item() ** 2
+
+class SparseOperator:
+    """
+    A sparse matrix held as CSR tensors of both X and X.T (see `as_sparse_csr`), so both
+    products are CSR @ dense and memory scales with nnz.
+    """
+    def __init__(self, X: torch.Tensor, Xt: torch.Tensor):
+        self.X = X
+        self.Xt = Xt
+        self.shape = tuple(X.shape)
+        self.device = X.device
+        self.dtype = X.dtype
+
+    def matmul(self, W: torch.Tensor) -> torch.Tensor:
+        return self.X @ W
+
+    def rmatmul(self, Y: torch.Tensor) -> torch.Tensor:
+        return self.Xt @ Y
+
+    def frobenius_sq(self) -> float:
+        return torch.linalg.vector_norm(self.X.values()).item() ** 2
+
+    def column_stats(self):
+        """
+        Column means and standard deviations (n - 1 denominator) from the nonzeros only.
+
+        Two-pass: the squared deviations of the stored values are summed per column and the
+        implicit zeros contribute (m - nnz_j) * mean_j^2.
+        """
+        m, n = self.shape
+        cols = self.X.col_indices().long()
+        vals = self.X.values()
+        mean = torch.zeros(n, device = self.device, dtype = self.dtype).index_add_(0, cols, vals) / m
+        nnz = torch.bincount(cols, minlength = n).to(self.dtype)
+        ss = torch.zeros(n, device = self.device, dtype = self.dtype).index_add_(0, cols, (vals - mean[cols]).square())
+        var = (ss + (m - nnz) * mean.square()) / (m - 1)
+        return mean, var.sqrt()
+
+class ScaledOperator:
+    """
+    Column centered and scaled matrix, A = (X - 1 mean^T) diag(1 / std), applied lazily
+    on top of another operator for X (dense or sparse).
+
+    The centering is a rank-one correction and the scaling a diagonal, so both fold into
+    the small (n x b) factor of each product and the scaled copy of X is never built:
+        A @ W   = X @ (W / std) - 1 (mean^T (W / std))
+        A.T @ Y = (X.T @ Y - mean (1^T Y)) / std
+    For sparse X this keeps every product at the cost of a sparse matmul.
+
+    Columns with a zero std (e.g. all-zero genes of a sparse count matrix), or outside the
+    `keep` mask when one is given, get a weight of zero instead of a division by zero, so they
+    drop out of the products without a reduced copy of X; `std` holds a scale of 1 for them.
+    The base values of those columns must be finite.
+    """
+    def __init__(self, base, mean: torch.Tensor, std: torch.Tensor, keep: torch.Tensor = None):
+        self.base = base
+        self.shape = base.shape
+        self.device = mean.device
+        self.dtype = mean.dtype
+        self.live = std > 0 if keep is None else keep.to(mean.device)
+        self.mean = torch.where(self.live, mean, torch.zeros_like(mean))
+        self.std = torch.where(self.live, std, torch.ones_like(std))
+        self.weight = self.live.to(self.dtype) / self.std
+
+    def matmul(self, W: torch.Tensor) -> torch.Tensor:
+        Ws = W * self.weight.unsqueeze(1)
+        return self.base.matmul(Ws).sub_(self.mean @ Ws)
+
+    def rmatmul(self, Y: torch.Tensor) -> torch.Tensor:
+        Z = self.base.rmatmul(Y).sub_(torch.outer(self.mean, Y.sum(dim=0)))
+        return Z.mul_(self.weight.unsqueeze(1))
+
+    def frobenius_sq(self) -> float:
+        #every scaled column has sum of squares (m - 1) * var / std^2 = m - 1, the dead ones 0
+        return float((self.shape[0] - 1) * int(self.live.sum()))
+
+def randomized_svd_linop(op, k: int, p: int = 10, q_iter: int = 2, orth: str = "qr"):
+    """
+    Randomized SVD of a linear operator (see module notes for the interface).
+
+    Follows randomized_svd_py step for step, but every product with A goes
+    through op.matmul/op.rmatmul, so each power iteration is two passes over A.
+    `orth` selects the orthonormalizer (see torch_orth.py).
+
+    Returns:
+        Tuple of (U, S, Vh) as tensors on op.device, with k + p components.
+    """
+    m, n = op.shape
+    #create random projection
+    Omega = torch.randn((n, k + p), device = op.device, dtype = op.dtype)
+    #subspace identification with optional power iterations for accuracy
+    Y = op.matmul(Omega)
+    del Omega
+    for i in range(q_iter):
+        Q = orthonormalize(op.rmatmul(Y), orth, final = False) # Project onto row space and get stable basis
+        Y = orthonormalize(op.matmul(Q), orth, final = False)
+    #orthonormalize the subspace to get a stable basis Q
+    Q = orthonormalize(Y, orth)
+    del Y
+    #project A onto the smaller subspace: B = Q.T @ A = (A.T @ Q).T
+    B = op.rmatmul(Q).T
+    #compute the SVD of the smaller matrix B
+    U_tilde, S, Vh = torch.linalg.svd(B, full_matrices = False)
+    #recover left singular vectors for the original matrix A
+    U = Q @ U_tilde
+    return U, S, Vh
@@ -0,0 +1,103 @@
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+# Orthonormalizers for the tall (m x b) matrices of the range finder.
+#   "qr"      torch.linalg.qr on the whole matrix (reference, default)
+#   "tsqr"    communication-avoiding tall-skinny QR: row blocks are factored in parallel
+#             and their stacked R factors reduced with one small QR
+#   "cholqr2" CholeskyQR twice: two (b x b) Gram/Cholesky factorizations and triangular
+#             solves, i.e. matmul speed; falls back to QR if the Gram matrix is not positive definite
+#   "lu"      LU with partial pivoting for the intermediate power iterations (a well conditioned,
+#             not orthonormal, basis of the same span); the final basis is always a QR
+ORTHONORMALIZERS = ("qr", "tsqr", "cholqr2", "lu")
+
+def _qr(Y):
+    return torch.linalg.qr(Y)[0]
+
+def tsqr(Y: torch.Tensor, block_rows: int = None) -> torch.Tensor:
+    """
+    Orthonormal basis of Y by TSQR.
+
+    Args:
+        Y: Tall matrix (m x b).
+        block_rows: Rows per block. Defaults to splitting Y into one block per torch thread;
+                    blocks never get smaller than 4 * b rows.
+
+    Returns:
+        Q with orthonormal columns spanning Y (m x b).
+    """
+    m, b = Y.shape
+    threads = torch.get_num_threads()
+    if block_rows is None:
+        block_rows = -(-m // threads)
+    n_blocks = min(m // max(block_rows, 4 * b), m // (4 * b))
+    if n_blocks < 2:
+        return _qr(Y)
+    blocks = torch.tensor_split(Y, n_blocks)
+    #each block's QR runs in its own thread; torch releases the GIL inside linalg
+    with ThreadPoolExecutor(max_workers = min(n_blocks, threads)) as pool:
+        factors = list(pool.map(torch.linalg.qr, blocks))
+    Q2, _ = torch.linalg.qr(torch.cat([R for _, R in factors]))
+    Q = torch.empty_like(Y)
+    i0 = 0
+    for i, (Q1, _) in enumerate(factors):
+        i1 = i0 + Q1.shape[0]
+        torch.matmul(Q1, Q2[i * b:(i + 1) * b], out = Q[i0:i1])
+        i0 = i1
+    return Q
+
+def cholqr2(Y: torch.Tensor) -> torch.Tensor:
+    """
+    Orthonormal basis of Y by CholeskyQR2 (Y = Q R with R from the Cholesky factor of Y.T @ Y,
+    repeated once to restore orthogonality). Falls back to QR when Y is too ill-conditioned.
+    """
+    Q = Y
+    for _ in range(2):
+        R, info = torch.linalg.cholesky_ex(Q.T @ Q, upper = True)
+        if info.item() != 0:
+            return _qr(Y)
+        Q = torch.linalg.solve_triangular(R, Q, upper = True, left = False)
+    return Q
+
+def lu_basis(Y: torch.Tensor) -> torch.Tensor:
+    """
+    Row-permuted unit lower triangular factor P @ L of Y = P L U.
+
+    Spans the same space as Y with bounded entries, which is all the intermediate power
+    iterations need, at the cost of an LU instead of a QR.
+    """
+    m, b = Y.shape
+    LU, pivots = torch.linalg.lu_factor(Y)
+    L = LU.tril(-1)
+    L.diagonal().fill_(1)
+    #LAPACK pivots are sequential row swaps; turn them into a permutation without building P (m x m)
+    perm = list(range(m))
+    for i, j in enumerate((pivots - 1).tolist()):
+        perm[i], perm[j] = perm[j], perm[i]
+    out = torch.empty_like(L)
+    out[torch.tensor(perm, device = Y.device)] = L
+    return out
+
+def orthonormalize(Y: torch.Tensor, method: str = "qr", final: bool = True, block_rows: int = None) -> torch.Tensor:
+    """
+    Basis for the range of Y with the chosen method.
+
+    Args:
+        Y: Tall matrix (m x b).
+        method: One of ORTHONORMALIZERS.
+        final: Whether this is the basis used for the projection B = Q.T @ A, which must be
+               orthonormal ("lu" then uses QR).
+        block_rows: Block size for "tsqr".
+
+    Returns:
+        Q (m x b).
+    """
+    if method == "qr":
+        return _qr(Y)
+    if method == "tsqr":
+        return tsqr(Y, block_rows)
+    if method == "cholqr2":
+        return cholqr2(Y)
+    if method == "lu":
+        return _qr(Y) if final else lu_basis(Y)
+    raise ValueError(f"Unknown orthonormalizer '{method}', expected one of {ORTHONORMALIZERS}")
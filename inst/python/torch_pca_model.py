@@ -0,0 +1,128 @@
+import torch
+import numpy as np
+import gc
+from torch_utils import get_device, is_sparse
+from torch_svd_func_ooc import is_out_of_core, open_row_source
+from torch_transform import _log2
+
+class PCAModel:
+    """
+    A fitted PCA that scores new samples without refitting.
+
+    Keeps the loadings (Vh), singular values and the centering/scaling vectors used for the
+    training data, and folds the preprocessing into one projection matrix cached on the
+    compute device:
+        scores = ((X - mean) / std) @ Vh.T = X @ W - offset,  W = Vh.T / std,  offset = mean @ W
+    so scoring a block of rows is a single matmul and the scaled copy of X is never built.
+    Scores are on the same scale as `get_pc_scores()` for the training samples (U diag(S)).
+    """
+    def __init__(self, Vh, S, mean=None, std=None, log2: int = 0, device: str = "cpu", cores: int = 2,
+                 pseudocount: float = 0):
+        self.device = get_device(device, cores)
+        self.S = np.asarray(S)
+        self.Vh = np.asarray(Vh)
+        self.mean = None if mean is None else np.asarray(mean)
+        self.std = None if std is None else np.asarray(std)
+        self.log2 = int(log2)
+        self.pseudocount = float(pseudocount)
+        self.dtype = torch.float32 if self.Vh.dtype == np.float32 else torch.float64
+        W = torch.as_tensor(self.Vh, dtype=self.dtype).T.contiguous()
+        if self.std is not None:
+            #constant training columns were never scaled
+            std_t = torch.as_tensor(self.std, dtype=self.dtype)
+            W = W / torch.where(std_t > 0, std_t, torch.ones_like(std_t)).unsqueeze(1)
+        offset = torch.zeros(W.shape[1], dtype=self.dtype)
+        if self.mean is not None:
+            offset = torch.as_tensor(self.mean, dtype=self.dtype) @ W
+        self.W = W.to(self.device)
+        self.offset = offset.to(self.device)
+
+    @classmethod
+    def from_state(cls, state, device: str = "cpu", cores: int = 2):
+        """
+        Builds a model from an incremental `PCAState` (see torch_svd_incremental.py).
+        """
+        std = np.sqrt(state.var) if state.scale == 1 else None
+        return cls(state.Vh, state.S, mean=state.mean, std=std, log2=state.log2, device=device, cores=cores)
+
+    def save(self, path):
+        """
+        Saves the model to a `.npz` file.
+        """
+        arrays = dict(Vh=self.Vh, S=self.S, log2=np.array(self.log2), pseudocount=np.array(self.pseudocount))
+        if self.mean is not None:
+            arrays["mean"] = self.mean
+        if self.std is not None:
+            arrays["std"] = self.std
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, device: str = "cpu", cores: int = 2):
+        """
+        Loads a model written by `save`.
+        """
+        with np.load(path) as f:
+            return cls(f["Vh"], f["S"], mean=f["mean"] if "mean" in f.files else None,
+                       std=f["std"] if "std" in f.files else None, log2=int(f["log2"]),
+                       device=device, cores=cores,
+                       pseudocount=float(f["pseudocount"]) if "pseudocount" in f.files else 0)
+
+    def transform(self, new_data, block_rows: int = 10_000, dataset: str = None):
+        """
+        Scores new samples, streaming `block_rows` rows at a time through the device.
+
+        Args:
+            new_data: New samples x features, untransformed like the training input. A NumPy
+                      array, scipy sparse matrix, np.memmap or a path to a `.npy`/HDF5/Zarr
+                      matrix (see `open_row_source`).
+            block_rows: Rows scored per block; memory is O(block_rows * features).
+            dataset: Dataset name for HDF5/Zarr inputs holding more than one matrix.
+
+        Returns:
+            NumPy array of scores (samples x k).
+        """
+        source = open_row_source(new_data, dataset) if is_out_of_core(new_data) else new_data
+        sparse = is_sparse(source)
+        if sparse and self.log2 == 1 and self.pseudocount == 0:
+            raise ValueError("log2 would turn the zeros of a sparse matrix into -Inf; log transform its nonzero values before calling")
+        m, n = (int(d) for d in source.shape)
+        if n != self.W.shape[0]:
+            raise ValueError(f"new data has {n} columns, the model was fitted on {self.W.shape[0]}")
+        block_rows = max(1, int(block_rows))
+        np_dtype = np.float32 if self.dtype == torch.float32 else np.float64
+        scores = np.empty((m, self.W.shape[1]), dtype=np_dtype)
+        Ai = None
+        for i0 in range(0, m, block_rows):
+            i1 = min(i0 + block_rows, m)
+            block = source[i0:i1]
+            block = block.toarray() if sparse else block
+            Ai = torch.from_numpy(np.array(block, dtype=np_dtype, order="C")).to(self.device)
+            if self.log2 == 1:
+                Ai = _log2(Ai, self.pseudocount)
+            scores[i0:i1] = (Ai @ self.W).sub_(self.offset).to("cpu").numpy()
+        del Ai
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+        gc.collect()
+        return scores
+
+def pca_transform_py(new_data, Vh, S, mean=None, std=None, log2: int = 0, block_rows: int = 10_000,
+                     device: str = "cpu", cores: int = 2, pseudocount: float = 0):
+    """
+    Scores new samples against a fitted PCA (e.g. the output of `FastPCA()`) in row blocks.
+
+    Args:
+        new_data: New samples x features. See `PCAModel.transform`.
+        Vh: Loadings (k x features).
+        S: Singular values (k,).
+        mean: Column means used to center the training data, or None.
+        std: Column standard deviations used to scale the training data, or None.
+        log2: integer of 1 or 0 for whether the training data were log2 transformed.
+        block_rows: Rows scored per block.
+        pseudocount: added before the log2 transform, as for the training data.
+
+    Returns:
+        NumPy array of scores (samples x k).
+    """
+    model = PCAModel(Vh, S, mean=mean, std=std, log2=log2, device=device, cores=cores, pseudocount=pseudocount)
+    return model.transform(new_data, block_rows=block_rows)
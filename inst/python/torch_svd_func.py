@@ -1,25 +1,61 @@
 import torch
 import numpy as np
 import gc
+from torch_svd_func_ooc import is_out_of_core, open_row_source, randomized_svd_ooc_py
+from torch_utils import as_tensor, as_sparse_csr, get_device, is_sparse
+from torch_linop import DenseOperator, RowBlockOperator, SparseOperator, randomized_svd_linop
+from torch_orth import orthonormalize
+from torch_svd_func_mixed import low_precision_dtype, randomized_svd_mixed
 
-def randomized_svd_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2, device: str = "cpu", cores: int = 2):
+def randomized_svd_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2, device: str = "cpu", cores: int = 2,
+                      block_rows: int = 10_000, orth: str = "qr", tol: float = None, target_variance: float = None,
+                      precision: str = "float64", refine: int = 1):
     """
     Performs Randomized SVD on a NumPy array using PyTorch.
 
     Args:
         A_np: Input NumPy array. Assumed to be Features x Samples based on original script's transpose logic.
               (e.g., if R passes Samples x Features, R side should transpose it before sending here).
+              A scipy.sparse matrix (e.g. R's dgCMatrix) or sparse torch tensor is multiplied in CSR
+              form and never densified.
         k: Number of singular values/vectors to compute.
         p: Oversampling parameter.
         q_iter: Number of power iterations.
+        block_rows: Rows read per block when A_np is out of core (a path, np.memmap or
+                    HDF5/Zarr dataset); see `randomized_svd_ooc_py`.
+        orth: Orthonormalizer for the power iterations and final basis: "qr", "tsqr",
+              "cholqr2" or "lu" (see torch_orth.py).
+        tol, target_variance: When either is given the rank is chosen adaptively with k as the
+              maximum rank and p as the block size; see `randomized_svd_adaptive_py`.
+        precision: "float64" (default), "float32" or "bfloat16". Anything but float64 runs the large
+              products in that dtype and the small QR/SVD in full precision (dense input only);
+              see `randomized_svd_mixed` in torch_svd_func_mixed.py.
+        refine: integer of 1 or 0 for whether the final projection is done in full precision
+              when `precision` is reduced.
 
     Returns:
-        Tuple of (U, S, Vh) as NumPy arrays.
+        Tuple of (U, S, Vh) as NumPy arrays. With a reduced `precision` the estimated relative
+        error ||A - U S Vh||_F / ||A||_F is appended.
         U: Left singular vectors (Features x k).
         S: Singular values (k).
         Vh: Transpose of right singular vectors (Samples x k).
     """
-    A = torch.tensor(A_np)
+    mixed = precision != "float64"
+    if mixed and (tol is not None or target_variance is not None or is_out_of_core(A_np) or is_sparse(A_np)):
+      raise ValueError("reduced precision is only available for dense input with a fixed rank")
+    if tol is not None or target_variance is not None:
+      return randomized_svd_adaptive_py(A_np, max_rank = k, block_size = p, q_iter = q_iter, tol = tol, target_variance = target_variance,
+                                        block_rows = block_rows, device = device, cores = cores, orth = orth)
+    #stream from disk instead of loading the whole matrix
+    if is_out_of_core(A_np):
+      return randomized_svd_ooc_py(A_np, k = k, p = p, q_iter = q_iter, block_rows = block_rows, device = device, cores = cores, orth = orth)
+    #sparse matrices stay sparse, memory scales with nnz
+    if is_sparse(A_np):
+      device = get_device(device, cores)
+      U, S, Vh = randomized_svd_linop(SparseOperator(*as_sparse_csr(A_np, device)), k = k, p = p, q_iter = q_iter, orth = orth)
+      return U.to("cpu").numpy(), S.to("cpu").numpy(), Vh.to("cpu").numpy()
+
+    A = as_tensor(A_np) #zero-copy view of the numpy/R memory when possible
     
     #check device from user
     compute_device = device
@@ -40,6 +76,16 @@ def randomized_svd_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2, de
     A = A.to(device)
     #print(f"Python (randomized_svd_py): Input tensor shape: {A.shape}, device: {A.device}")
 
+    if mixed:
+      U, S, Vh, error = randomized_svd_mixed(A, k, p = p, q_iter = q_iter, low_dtype = low_precision_dtype(precision, device),
+                                             refine = refine, orth = orth)
+      U, S, Vh = U.to("cpu").numpy(), S.to("cpu").numpy(), Vh.to("cpu").numpy()
+      del A
+      if device.type == "cuda":
+          torch.cuda.empty_cache()
+      gc.collect()
+      return U, S, Vh, error
+
     m, n = A.shape
     device = A.device
     dtype = A.dtype
@@ -50,10 +96,10 @@ def randomized_svd_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2, de
     # for _ in range(q_iter):
     #     Y = A @ (A.T @ Y)
     for i in range(q_iter):
-        Q, _ = torch.linalg.qr(A.T @ Y) # Project onto row space and get stable basis
-        Y, _ = torch.linalg.qr(A @ Q)
+        Q = orthonormalize(A.T @ Y, orth, final = False) # Project onto row space and get stable basis
+        Y = orthonormalize(A @ Q, orth, final = False)
     #orthonormalize the subspace to get a stable basis Q
-    Q, _ = torch.linalg.qr(Y)
+    Q = orthonormalize(Y, orth)
     #project A onto the smaller subspace
     B = Q.T @ A
     #compute the SVD of the smaller matrix B
@@ -72,6 +118,205 @@ def randomized_svd_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2, de
     gc.collect()
     #final return
     return U, S, Vh
+
+def adaptive_range_finder(op, max_rank: int, block_size: int = 10, q_iter: int = 2,
+                          tol: float = None, target_variance: float = None, orth: str = "qr"):
+    """
+    Blocked randomized range finder that grows Q until a target accuracy is reached.
+
+    Each step draws `block_size` new directions, runs the power iterations on the part of A not
+    yet captured (A - Q @ B, never formed), orthogonalizes against Q and appends Q_i and
+    B_i = Q_i.T @ A. Since ||A - Q Q.T A||_F^2 = ||A||_F^2 - ||B||_F^2 the residual is tracked
+    for free and the loop stops as soon as it is small enough.
+
+    Args:
+        op: Linear operator (see torch_linop.py).
+        max_rank: Largest basis to build.
+        block_size: Number of columns added per step.
+        q_iter: Power iterations per step.
+        tol: Stop once ||A - Q Q.T A||_F / ||A||_F <= tol.
+        target_variance: Stop once the captured share of ||A||_F^2 (the cumulative proportion of
+                         variance explained for centered A) reaches this value (0-1).
+        orth: Orthonormalizer, see torch_orth.py.
+
+    Returns:
+        Tuple of (Q, B, norm_sq): the basis (m x r), B = Q.T @ A (r x n) and ||A||_F^2.
+    """
+    m, n = op.shape
+    max_rank = min(max_rank, m, n)
+    norm_sq = op.frobenius_sq()
+    residual_sq = norm_sq
+    Q = torch.empty((m, 0), device = op.device, dtype = op.dtype)
+    B = torch.empty((0, n), device = op.device, dtype = op.dtype)
+    while Q.shape[1] < max_rank:
+        b = min(block_size, max_rank - Q.shape[1])
+        Omega = torch.randn((n, b), device = op.device, dtype = op.dtype)
+        #sample the residual A - Q @ B
+        Y = op.matmul(Omega) - Q @ (B @ Omega)
+        for i in range(q_iter):
+            Y = orthonormalize(Y, orth, final = False)
+            Z = orthonormalize(op.rmatmul(Y) - B.T @ (Q.T @ Y), orth, final = False)
+            Y = op.matmul(Z) - Q @ (B @ Z)
+        #orthogonalize twice against the basis found so far
+        Qi = orthonormalize(Y - Q @ (Q.T @ Y))
+        Qi = orthonormalize(Qi - Q @ (Q.T @ Qi))
+        Bi = op.rmatmul(Qi).T
+        Q = torch.cat([Q, Qi], dim = 1)
+        B = torch.cat([B, Bi], dim = 0)
+        residual_sq -= torch.linalg.vector_norm(Bi).item() ** 2
+        if tol is not None and residual_sq <= (tol ** 2) * norm_sq:
+            break
+        if target_variance is not None and 1 - residual_sq / norm_sq >= target_variance:
+            break
+    return Q, B, norm_sq
+
+def _as_operator(A_np, device, block_rows):
+    if is_out_of_core(A_np):
+        A = open_row_source(A_np)
+        dtype = torch.float32 if np.dtype(A.dtype) == np.float32 else torch.float64
+        return RowBlockOperator(A, block_rows = block_rows, device = device, dtype = dtype)
+    if is_sparse(A_np):
+        return SparseOperator(*as_sparse_csr(A_np, device))
+    return DenseOperator(as_tensor(A_np).to(device))
+
+def adaptive_svd_linop(op, max_rank: int, block_size: int = 10, q_iter: int = 2,
+                       tol: float = None, target_variance: float = None, orth: str = "qr"):
+    """
+    SVD from `adaptive_range_finder`, truncated to the smallest rank meeting the targets.
+
+    Returns:
+        Tuple of (U, S, Vh, rank, error) where error is the estimated relative residual
+        ||A - U S Vh||_F / ||A||_F at the returned rank.
+    """
+    Q, B, norm_sq = adaptive_range_finder(op, max_rank, block_size = block_size, q_iter = q_iter,
+                                          tol = tol, target_variance = target_variance, orth = orth)
+    U_tilde, S, Vh = torch.linalg.svd(B, full_matrices = False)
+    #residual share after each component
+    remaining = (1 - torch.cumsum(S.square(), 0) / norm_sq).clamp_(min = 0)
+    rank = S.shape[0]
+    if tol is not None or target_variance is not None:
+        #smallest rank meeting every requested target
+        needed = 1
+        if target_variance is not None:
+            needed = max(needed, int((remaining > 1 - target_variance).sum()) + 1)
+        if tol is not None:
+            needed = max(needed, int((remaining > tol ** 2).sum()) + 1)
+        rank = min(rank, needed)
+    error = remaining[rank - 1].sqrt().item()
+    U = Q @ U_tilde[:, :rank]
+    return U, S[:rank], Vh[:rank], rank, error
+
+def randomized_svd_adaptive_py(A_np: np.ndarray, max_rank: int = 200, block_size: int = 10, q_iter: int = 2,
+                               tol: float = None, target_variance: float = None, block_rows: int = 10_000,
+                               device: str = "cpu", cores: int = 2, orth: str = "qr"):
+    """
+    Performs Randomized SVD with the rank chosen adaptively, instead of a fixed k and p.
+
+    The basis grows `block_size` columns at a time and stops when the estimated relative
+    residual drops below `tol` or the proportion of ||A||_F^2 captured (variance explained for a
+    centered matrix) reaches `target_variance`, or at `max_rank`. Accepts the same inputs as
+    `randomized_svd_py` (dense, sparse or out of core).
+
+    Args:
+        A_np: Input matrix.
+        max_rank: Upper bound on the rank.
+        block_size: Columns added to the basis per step.
+        q_iter: Power iterations per step.
+        tol: Target relative Frobenius error.
+        target_variance: Target cumulative proportion of variance explained (0-1).
+        block_rows: Rows per block for out-of-core input.
+        orth: Orthonormalizer, see torch_orth.py.
+
+    Returns:
+        Tuple of (U, S, Vh, rank, error): NumPy arrays truncated to the chosen rank, the rank,
+        and the estimated relative error ||A - U S Vh||_F / ||A||_F.
+    """
+    device = get_device(device, cores)
+    op = _as_operator(A_np, device, block_rows)
+    U, S, Vh, rank, error = adaptive_svd_linop(op, max_rank, block_size = block_size, q_iter = q_iter,
+                                               tol = tol, target_variance = target_variance, orth = orth)
+    U = U.to("cpu").numpy()
+    S = S.to("cpu").numpy()
+    Vh = Vh.to("cpu").numpy()
+    del op
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    gc.collect()
+    return U, S, Vh, rank, error
+
+def _randomized_svd_batch(A: torch.Tensor, k: int, p: int, q_iter: int):
+    #randomized SVD of a (batch, m, n) tensor; matmul, QR and SVD all take batch dimensions
+    b = min(k + p, A.shape[-2], A.shape[-1])
+    Omega = torch.randn((A.shape[0], A.shape[-1], b), device = A.device, dtype = A.dtype)
+    Y = A @ Omega
+    for i in range(q_iter):
+        Q = torch.linalg.qr(A.mT @ Y)[0]
+        Y = torch.linalg.qr(A @ Q)[0]
+    Q = torch.linalg.qr(Y)[0]
+    U_tilde, S, Vh = torch.linalg.svd(Q.mT @ A, full_matrices = False)
+    return Q @ U_tilde, S, Vh
+
+def randomized_svd_batched_py(matrices, k: int, p: int = 10, q_iter: int = 2, device: str = "cpu", cores: int = 2,
+                              pad: int = 0, max_batch_elements: int = 2 ** 27):
+    """
+    Randomized SVD of many independent matrices at once.
+
+    Matrices of the same shape are stacked and go through the range finder, QR and small SVD as
+    batched torch operations, so hundreds of small problems cost a handful of kernel launches
+    instead of one `randomized_svd_py` call (thread setup, transfers, cleanup) each. Ragged
+    inputs are grouped by shape, or with `pad` zero-padded to the largest shape and run as one
+    batch: zero rows and columns do not change the singular values, and the padding is sliced
+    off the singular vectors.
+
+    Args:
+        matrices: List of 2-D arrays (e.g. an R list of matrices), or a 3-D array (batch x m x n).
+        k: Number of singular values/vectors to compute.
+        p: Oversampling parameter.
+        q_iter: Number of power iterations.
+        pad: integer of 1 or 0 for whether to zero-pad ragged matrices to a common shape.
+        max_batch_elements: Largest number of matrix entries moved to the device per batch.
+
+    Returns:
+        List of (U, S, Vh) tuples of NumPy arrays in input order, each with min(k + p, m, n)
+        components like `randomized_svd_py`.
+    """
+    device = get_device(device, cores)
+    if isinstance(matrices, (np.ndarray, torch.Tensor)) and matrices.ndim == 3:
+        matrices = list(matrices)
+    mats = [as_tensor(M, verbose = False) for M in matrices]
+    if any(M.ndim != 2 for M in mats):
+        raise ValueError("every input must be a 2-dimensional matrix")
+    if not mats:
+        return []
+    dtype = torch.float32 if all(M.dtype == torch.float32 for M in mats) else torch.float64
+    shapes = [tuple(M.shape) for M in mats]
+    if pad == 1:
+        target = (max(s[0] for s in shapes), max(s[1] for s in shapes))
+        groups = {target: list(range(len(mats)))}
+    else:
+        groups = {}
+        for i, shape in enumerate(shapes):
+            groups.setdefault(shape, []).append(i)
+
+    results = [None] * len(mats)
+    for (m, n), idx in groups.items():
+        per_batch = max(1, max_batch_elements // max(m * n, 1))
+        for c0 in range(0, len(idx), per_batch):
+            chunk = idx[c0:c0 + per_batch]
+            A = torch.zeros((len(chunk), m, n), dtype = dtype)
+            for j, i in enumerate(chunk):
+                A[j, :shapes[i][0], :shapes[i][1]] = mats[i]
+            U, S, Vh = _randomized_svd_batch(A.to(device), k, p, q_iter)
+            U, S, Vh = U.to("cpu").numpy(), S.to("cpu").numpy(), Vh.to("cpu").numpy()
+            for j, i in enumerate(chunk):
+                mi, ni = shapes[i]
+                b = min(k + p, mi, ni)
+                results[i] = (U[j, :mi, :b], S[j, :b], Vh[j, :b, :ni])
+            del A
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    gc.collect()
+    return results
 # 
 # if __name__ == "__main__":
 #     import time
@@ -0,0 +1,174 @@
+import torch
+import torch.distributed as dist
+import numpy as np
+import importlib
+import tempfile
+import os
+import gc
+from torch_utils import as_tensor
+from torch_svd_func_ooc import is_out_of_core, open_row_source
+
+# Row-partitioned randomized SVD. Every process holds a block of rows A_i of A and
+#   A @ W   is purely local (rows of the result stay where the rows of A are),
+#   A.T @ Y = sum_i A_i.T @ Y_i is an allreduce of an (n x b) matrix,
+# and the tall Y is orthonormalized with TSQR, so the only traffic is O(n * (k + p))
+# per pass plus a (b x b) R factor from every rank.
+
+def row_range(m: int, rank: int, world_size: int):
+    """
+    Rows [i0, i1) of an m row matrix owned by `rank`; blocks differ in size by at most one row.
+    """
+    return rank * m // world_size, (rank + 1) * m // world_size
+
+def tsqr(Y_local: torch.Tensor):
+    """
+    Tall-skinny QR of a matrix whose rows are split across the process group.
+
+    Each rank factors its own block, the (b x b) R factors are all-gathered and factored
+    once more, and the local Q is corrected with its slice of that second Q.
+
+    Returns:
+        Tuple of (Q_local, R): the rows of Q owned by this rank and the shared (b x b) R.
+    """
+    b = Y_local.shape[1]
+    Q1, R1 = torch.linalg.qr(Y_local)
+    if R1.shape[0] < b:
+        #fewer local rows than columns: pad so every rank contributes a (b x b) factor
+        pad = b - R1.shape[0]
+        Q1 = torch.nn.functional.pad(Q1, (0, pad))
+        R1 = torch.nn.functional.pad(R1, (0, 0, 0, pad))
+    Rs = [torch.empty_like(R1) for _ in range(dist.get_world_size())]
+    dist.all_gather(Rs, R1.contiguous())
+    Q2, R = torch.linalg.qr(torch.cat(Rs))
+    rank = dist.get_rank()
+    return Q1 @ Q2[rank * b:(rank + 1) * b], R
+
+@torch.no_grad()
+def randomized_svd_dist(A_local: torch.Tensor, n: int, k: int, p: int = 10, q_iter: int = 2):
+    """
+    Randomized SVD of a row-partitioned matrix inside an initialized process group.
+
+    Mirrors randomized_svd_py; every rank must call it with its own rows of A.
+
+    Args:
+        A_local: This rank's rows of A (rows x n), possibly zero rows.
+        n: Number of columns of A.
+        k, p, q_iter: as for randomized_svd_py.
+
+    Returns:
+        Tuple of (U_local, S, Vh): the rows of U for this rank's rows of A and the
+        shared singular values / right singular vectors, with k + p components.
+    """
+    dtype, device = A_local.dtype, A_local.device
+    #same random projection on every rank
+    Omega = torch.randn((n, k + p), device = device, dtype = dtype)
+    dist.broadcast(Omega, src = 0)
+    Y = A_local @ Omega
+    for i in range(q_iter):
+        Z = A_local.T @ Y
+        dist.all_reduce(Z)
+        Q, _ = torch.linalg.qr(Z)
+        #keep the basis bit-identical across ranks
+        dist.broadcast(Q, src = 0)
+        Y, _ = tsqr(A_local @ Q)
+    #orthonormalize the distributed subspace
+    Q, _ = tsqr(Y)
+    #B = Q.T @ A as a sum over the row blocks
+    B = Q.T @ A_local
+    dist.all_reduce(B)
+    U_tilde, S, Vh = torch.linalg.svd(B, full_matrices = False)
+    for t in (U_tilde, S, Vh):
+        dist.broadcast(t, src = 0)
+    return Q @ U_tilde, S, Vh
+
+def _local_rows(A, i0, i1):
+    if isinstance(A, torch.Tensor):
+        return A[i0:i1]
+    #out of core: each rank only reads its own rows
+    return torch.from_numpy(np.array(A[i0:i1], dtype = np.float64, order = "C"))
+
+def _worker(rank, world_size, init_file, A, k, p, q_iter, threads, U_out, S_out, Vh_out):
+    torch.set_num_threads(threads)
+    dist.init_process_group("gloo", init_method = f"file://{init_file}", rank = rank, world_size = world_size)
+    try:
+        if not isinstance(A, torch.Tensor):
+            A = open_row_source(A)
+        m, n = A.shape
+        i0, i1 = row_range(m, rank, world_size)
+        U_i, S, Vh = randomized_svd_dist(_local_rows(A, i0, i1), n, k, p, q_iter)
+        #results land in shared memory allocated by the parent
+        U_out[i0:i1] = U_i
+        if rank == 0:
+            S_out.copy_(S)
+            Vh_out.copy_(Vh)
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+def randomized_svd_dist_py(A_np, k: int, p: int = 10, q_iter: int = 2, world_size: int = 2, cores: int = 2):
+    """
+    Performs Randomized SVD with the rows of A split across `world_size` local processes
+    (torch.distributed, gloo backend, CPU only).
+
+    In-memory input is placed in shared memory once and every worker takes a view of its rows;
+    a path to a `.npy`/HDF5/Zarr matrix is opened by each worker, which then only reads its own rows.
+    For several machines, launch this file with torchrun instead (see the `__main__` block).
+
+    Args:
+        A_np: Input NumPy array, or a path/dataset accepted by `open_row_source`.
+        k: Number of singular values/vectors to compute.
+        p: Oversampling parameter.
+        q_iter: Number of power iterations.
+        world_size: Number of worker processes.
+        cores: Total CPU threads, shared evenly between the workers.
+
+    Returns:
+        Tuple of (U, S, Vh) as NumPy arrays, with k + p components like `randomized_svd_py`.
+    """
+    import torch.multiprocessing as mp
+    if is_out_of_core(A_np):
+        A = os.fspath(A_np) if isinstance(A_np, (str, os.PathLike)) else A_np
+        m, n = open_row_source(A).shape
+    else:
+        A = as_tensor(A_np).to(torch.float64).share_memory_()
+        m, n = A.shape
+    b = k + p
+    U = torch.zeros((m, b), dtype = torch.float64).share_memory_()
+    S = torch.zeros(b, dtype = torch.float64).share_memory_()
+    Vh = torch.zeros((b, n), dtype = torch.float64).share_memory_()
+    threads = max(1, cores // world_size)
+    #resolve the worker by module so it can be found when this file was run with py_run_file
+    worker = importlib.import_module("torch_svd_func_dist")._worker
+    with tempfile.TemporaryDirectory() as tmp:
+        mp.spawn(worker, args = (world_size, os.path.join(tmp, "init"), A, k, p, q_iter, threads, U, S, Vh),
+                 nprocs = world_size, join = True)
+    out = U.numpy(), S.numpy(), Vh.numpy()
+    del A
+    gc.collect()
+    return out
+
+if __name__ == "__main__":
+    #multi-node entry point, e.g. on every node:
+    #  torchrun --nnodes 2 --nproc-per-node 4 --rdzv-endpoint host:29500 torch_svd_func_dist.py A.npy out.npz --k 50
+    #the input must be readable from every node (shared filesystem); rank 0 writes U, S and Vh.
+    import argparse
+    parser = argparse.ArgumentParser(description = "Row-partitioned randomized SVD")
+    parser.add_argument("input", help = "path to a .npy, HDF5 or Zarr matrix")
+    parser.add_argument("output", help = "path of the .npz file written by rank 0")
+    parser.add_argument("--k", type = int, default = 100)
+    parser.add_argument("--p", type = int, default = 10)
+    parser.add_argument("--q_iter", type = int, default = 2)
+    parser.add_argument("--dataset", default = None)
+    args = parser.parse_args()
+
+    dist.init_process_group("gloo")
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    A = open_row_source(args.input, args.dataset)
+    m, n = A.shape
+    i0, i1 = row_range(m, rank, world_size)
+    U_i, S, Vh = randomized_svd_dist(_local_rows(A, i0, i1), n, args.k, args.p, args.q_iter)
+    U_blocks = [None] * world_size if rank == 0 else None
+    dist.gather_object(U_i, U_blocks, dst = 0)
+    if rank == 0:
+        np.savez(args.output, U = torch.cat(U_blocks).numpy(), S = S.numpy(), Vh = Vh.numpy())
+    dist.destroy_process_group()
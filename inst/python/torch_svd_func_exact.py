@@ -1,6 +1,7 @@
 import torch
 import numpy as np
 import gc
+from torch_utils import as_tensor
 
 def exact_svd_py(A_np: np.ndarray, device: str = "cpu", cores: int = 2):
     """
@@ -16,7 +17,7 @@ def exact_svd_py(A_np: np.ndarray, device: str = "cpu", cores: int = 2):
         S: Singular values (k).
         Vh: Transpose of right singular vectors (Samples x k).
     """
-    A = torch.tensor(A_np)
+    A = as_tensor(A_np) #zero-copy view of the numpy/R memory when possible
     #identify right device
     compute_device = device
     # Detect and send tensor to CUDA if available, otherwise CPU
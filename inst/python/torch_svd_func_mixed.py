@@ -0,0 +1,117 @@
+import torch
+from torch_orth import orthonormalize
+
+PRECISIONS = {"float64": torch.float64, "float32": torch.float32, "bfloat16": torch.bfloat16}
+#values of A cast to the low precision at a time (one block of rows), instead of a full low precision copy
+BLOCK_ELEMENTS = 2 ** 20
+
+def low_precision_dtype(precision: str, device: torch.device) -> torch.dtype:
+    """
+    Resolves the working dtype for the large matrix products.
+
+    bfloat16 matmuls are not available on every CPU build; when a small probe fails the
+    computation falls back to float32 with a notice.
+
+    Args:
+        precision: "float64", "float32" or "bfloat16".
+        device: Compute device.
+
+    Returns:
+        A torch dtype.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision '{precision}'; expected one of {', '.join(PRECISIONS)}")
+    dtype = PRECISIONS[precision]
+    if dtype == torch.bfloat16:
+        try:
+            x = torch.ones((4, 4), device=device, dtype=dtype)
+            x @ x
+        except RuntimeError:
+            print("bfloat16 matrix products are not supported on this device;\nFalling back to float32")
+            dtype = torch.float32
+    return dtype
+
+def _row_blocks(A: torch.Tensor, block_elements: int):
+    step = max(1, block_elements // max(A.shape[1], 1))
+    for i0 in range(0, A.shape[0], step):
+        yield i0, min(i0 + step, A.shape[0])
+
+def low_precision_matmul(A: torch.Tensor, W: torch.Tensor, low_dtype: torch.dtype,
+                         block_elements: int = BLOCK_ELEMENTS) -> torch.Tensor:
+    """
+    A @ W with the products in `low_dtype`, casting A one block of rows at a time.
+
+    Only one block of about `block_elements` values of A exists in low precision at any time;
+    the result is returned in the dtype of A.
+    """
+    W_lo = W.to(low_dtype)
+    out = torch.empty((A.shape[0], W.shape[1]), device=A.device, dtype=A.dtype)
+    for i0, i1 in _row_blocks(A, block_elements):
+        out[i0:i1] = A[i0:i1].to(low_dtype) @ W_lo
+    return out
+
+def low_precision_rmatmul(A: torch.Tensor, Y: torch.Tensor, low_dtype: torch.dtype,
+                          block_elements: int = BLOCK_ELEMENTS) -> torch.Tensor:
+    """
+    A.T @ Y with the products in `low_dtype`, casting A one block of rows at a time.
+
+    The per-block products are accumulated in the dtype of A.
+    """
+    out = torch.zeros((A.shape[1], Y.shape[1]), device=A.device, dtype=A.dtype)
+    for i0, i1 in _row_blocks(A, block_elements):
+        out.add_(A[i0:i1].to(low_dtype).T @ Y[i0:i1].to(low_dtype))
+    return out
+
+def estimate_error(A: torch.Tensor, U: torch.Tensor, S: torch.Tensor, Vh: torch.Tensor, n_probes: int = 10) -> float:
+    """
+    A posteriori estimate of the relative error ||A - U diag(S) Vh||_F / ||A||_F.
+
+    For Gaussian w, E||M w||^2 = ||M||_F^2, so a few probes give the residual and the norm of A
+    without forming either (Halko, Martinsson & Tropp 2011, sec. 4.3). Computed in the dtype of A.
+    """
+    W = torch.randn((A.shape[1], n_probes), device=A.device, dtype=A.dtype)
+    AW = A @ W
+    R = AW - U @ (S.unsqueeze(1) * (Vh @ W))
+    return (torch.linalg.vector_norm(R) / torch.linalg.vector_norm(AW)).item()
+
+def randomized_svd_mixed(A: torch.Tensor, k: int, p: int = 10, q_iter: int = 2, low_dtype: torch.dtype = torch.float32,
+                         refine: int = 1, orth: str = "qr"):
+    """
+    Randomized SVD with the large products in low precision and the small ones in float64.
+
+    A @ Omega, A.T @ Y and A @ Z (the GEMMs that touch all of A) run in `low_dtype`. A is cast
+    one block of rows at a time inside the products (`low_precision_matmul`), so no low
+    precision copy of the whole matrix is kept next to it; the extra memory is one block.
+    Their (m x b) / (n x b) results are promoted to the precision of A before the QRs, and
+    the SVD of the small B is always done in full precision. The range finder only needs the
+    span of Y, which low precision barely perturbs; with `refine` the final projection
+    B = Q.T @ A is one full-precision pass so the singular values and vectors keep the
+    accuracy of A.
+
+    Args:
+        A: Dense tensor (m x n), on the compute device, in full precision.
+        k: Number of singular values/vectors to compute.
+        p: Oversampling parameter.
+        q_iter: Number of power iterations.
+        low_dtype: dtype of the large products (torch.float32 or torch.bfloat16).
+        refine: integer of 1 or 0 for whether to compute the final projection in full precision.
+        orth: Orthonormalizer, see torch_orth.py.
+
+    Returns:
+        Tuple of (U, S, Vh, error) with U, S, Vh tensors in the dtype of A and error the estimated
+        relative Frobenius error of the factorization (see `estimate_error`).
+    """
+    n = A.shape[1]
+    Omega = torch.randn((n, k + p), device=A.device, dtype=low_dtype)
+    Y = low_precision_matmul(A, Omega, low_dtype)
+    for i in range(q_iter):
+        Q = orthonormalize(low_precision_rmatmul(A, Y, low_dtype), orth, final=False)
+        Y = orthonormalize(low_precision_matmul(A, Q, low_dtype), orth, final=False)
+    Q = orthonormalize(Y, orth)
+    if refine == 1:
+        B = (A.T @ Q).T
+    else:
+        B = low_precision_rmatmul(A, Q, low_dtype).T
+    U_tilde, S, Vh = torch.linalg.svd(B, full_matrices=False)
+    U = Q @ U_tilde
+    return U, S, Vh, estimate_error(A, U, S, Vh)
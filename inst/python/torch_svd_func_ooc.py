@@ -0,0 +1,102 @@
+import torch
+import numpy as np
+import os
+import gc
+from torch_utils import get_device, is_sparse
+from torch_linop import RowBlockOperator, randomized_svd_linop
+
+def is_out_of_core(A) -> bool:
+    """
+    Whether A should be streamed from disk rather than treated as an in-memory array.
+
+    True for file paths, np.memmap arrays and array-like chunked stores (h5py/zarr
+    datasets) that expose `shape` and row slicing.
+    """
+    if isinstance(A, (str, os.PathLike, np.memmap)):
+        return True
+    if isinstance(A, (np.ndarray, torch.Tensor)) or is_sparse(A):
+        return False
+    return hasattr(A, "shape") and hasattr(A, "__getitem__") and len(A.shape) == 2
+
+def open_row_source(source, dataset: str = None):
+    """
+    Opens a matrix for row-block streaming without reading it into memory.
+
+    Args:
+        source: np.memmap / np.ndarray, a path to a `.npy` file, an HDF5 file (`.h5`, `.hdf5`)
+                or a Zarr store (`.zarr`), or any dataset object exposing `shape` and row slicing.
+        dataset: Name of the dataset inside an HDF5 file or Zarr group. Optional when the
+                 file holds a single 2-dimensional dataset.
+
+    Returns:
+        An object supporting `source.shape` and `source[i0:i1]`.
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        return source
+    path = os.fspath(source)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Input matrix not found at: {path}")
+    ext = os.path.splitext(path.rstrip("/"))[1].lower()
+    if ext == ".npy":
+        return np.load(path, mmap_mode="r")
+    if ext in (".h5", ".hdf5"):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Reading HDF5 input requires the 'h5py' module in the current Python environment.")
+        f = h5py.File(path, "r")
+        if dataset is None:
+            candidates = []
+            f.visititems(lambda name, obj: candidates.append(name) if isinstance(obj, h5py.Dataset) and obj.ndim == 2 else None)
+            if len(candidates) != 1:
+                raise ValueError(f"Found {len(candidates)} 2-dimensional datasets in {path}; please supply `dataset`.")
+            dataset = candidates[0]
+        return f[dataset]
+    if ext == ".zarr":
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError("Reading Zarr input requires the 'zarr' module in the current Python environment.")
+        store = zarr.open(path, mode="r")
+        if dataset is not None:
+            store = store[dataset]
+        return store
+    raise ValueError(f"Unsupported file type '{ext}'; expected .npy, .h5/.hdf5 or .zarr")
+
+def randomized_svd_ooc_py(source, k: int, p: int = 10, q_iter: int = 2, block_rows: int = 10_000,
+                          dataset: str = None, device: str = "cpu", cores: int = 2, orth: str = "qr"):
+    """
+    Performs Randomized SVD on a matrix streamed from disk in blocks of rows.
+
+    Every pass over A (A @ Omega, the power iterations and Q.T @ A) reads
+    `block_rows` rows at a time, so peak memory is O(block_rows * n + (m + n) * (k + p))
+    instead of two full copies of A.
+
+    Args:
+        source: Matrix to decompose. See `open_row_source` for what is accepted.
+        k: Number of singular values/vectors to compute.
+        p: Oversampling parameter.
+        q_iter: Number of power iterations.
+        block_rows: Number of rows of A to hold in memory at once.
+        dataset: Dataset name for HDF5/Zarr inputs holding more than one matrix.
+        orth: Orthonormalizer, see torch_orth.py.
+
+    Returns:
+        Tuple of (U, S, Vh) as NumPy arrays, with k + p components like `randomized_svd_py`.
+    """
+    device = get_device(device, cores)
+    A = open_row_source(source, dataset)
+    #compute in double unless the file is stored in single precision
+    dtype = torch.float32 if np.dtype(A.dtype) == np.float32 else torch.float64
+    op = RowBlockOperator(A, block_rows = block_rows, device = device, dtype = dtype)
+    U, S, Vh = randomized_svd_linop(op, k = k, p = p, q_iter = q_iter, orth = orth)
+
+    #return results
+    U = U.to("cpu").numpy()
+    S = S.to("cpu").numpy()
+    Vh = Vh.to("cpu").numpy()
+    del op, A
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    gc.collect()
+    return U, S, Vh
@@ -1,6 +1,10 @@
 import torch
 from contextlib import nullcontext
 import numpy as np
+from torch_svd_func_ooc import is_out_of_core, randomized_svd_ooc_py
+from torch_utils import as_tensor
+from torch_autotune import autotune_stream
+from torch_svd_func_mixed import low_precision_matmul, low_precision_rmatmul
 
 # note: call torch.set_float32_matmul_precision("high") once at init if you like
 # and optionally set torch.backends.cuda.matmul.allow_tf32 = True on Ampere+ GPUs.
@@ -12,13 +16,15 @@ def randomized_svd_tsolve_stream(
     p: int = 10,
     q_iter: int = 2,
     block_rows: int = 32_000,     # stream rows of A/Y for C = Y^T @ A
-    use_amp: bool = False,         # bf16/fp16 matmuls with fp32 accumulate
+    use_amp: bool = False,         # bf16/fp16 matmuls with fp32 accumulate (CUDA), float32 range finder (CPU)
     #device: torch.device | None = None,
     dtype: torch.dtype | None = None,
     return_u: bool = True,
     return_v: bool = True,
     device: str = "CPU",
-    cores: int = 4
+    cores: int = 4,
+    autotune: bool = False,        # calibrate block_rows and threads on this matrix (cached per shape)
+    memory_budget_mb: float | None = None
 ):
     """
     Randomized SVD using:
@@ -36,10 +42,27 @@ def randomized_svd_tsolve_stream(
       p: oversampling
       q_iter: power iterations (0,1,2...)
       block_rows: streaming block size for row-wise accumulation of C
-      use_amp: autocast matmuls where safe
+      use_amp: autocast matmuls where safe. On the CPU the range finder products (A @ Omega,
+               A.T @ Y, A @ Z) run in float32, casting A one block of rows at a time, while the
+               QRs, triangular solves, the streamed C = Y^T @ A and the small SVD stay in the
+               dtype of A.
       device/dtype: optional overrides
+      autotune: pick `block_rows` and the CPU thread count (at most `cores`) with a short
+                calibration on the first rows of A, see torch_autotune.autotune_stream. The choice is
+                cached for later calls on a matrix of the same shape and dtype.
+      memory_budget_mb: memory allowed for one streamed block when autotuning
+                (default: a quarter of the free memory).
+
+    A_np may also be out of core (a path, np.memmap or HDF5/Zarr dataset), in which
+    case every pass over A is streamed from disk in blocks of `block_rows` rows.
     """
-    A = torch.tensor(A_np)
+    if is_out_of_core(A_np):
+        U, S, Vh = randomized_svd_ooc_py(A_np, k, p = p, q_iter = q_iter, block_rows = block_rows, device = device, cores = cores)
+        if not return_v:
+            return (U[:, :k] if return_u else None), S[:k]
+        return U[:, :k], S[:k], Vh[:k, :]
+
+    A = as_tensor(A_np) #zero-copy view of the numpy/R memory when possible
     
     #check device from user
     compute_device = device
@@ -64,30 +87,42 @@ def randomized_svd_tsolve_stream(
     m, n = A.shape
     b = k + p
     assert b <= min(m, n), "k+p must be <= min(m, n) for stability"
+    if autotune:
+        block_rows = autotune_stream(A, b, cores = cores if device.type == "cpu" else 1,
+                                     memory_budget_mb = memory_budget_mb)["block_rows"]
 
     # autocast only for matmuls; qr/svd stay in fp32 for stability
     amp_ctx = torch.cuda.amp.autocast if (use_amp and device.type == "cuda") else nullcontext
+    cpu_amp = use_amp and device.type == "cpu" and dtype == torch.float64
+    # CPU autocast only covers bfloat16 and is not faster everywhere; cast blocks of A to float32 inside the products
+    # instead of keeping a float32 copy of A
+    if cpu_amp:
+        matmul = lambda X: low_precision_matmul(A, X, torch.float32)
+        rmatmul = lambda X: low_precision_rmatmul(A, X, torch.float32)
+    else:
+        matmul = lambda X: A @ X
+        rmatmul = lambda X: A.T @ X
 
     # ---- range finder: Y = A @ Omega (and power iterations) ----
     with amp_ctx():
         # Omega on-the-fly (no need to store huge n x b if you don't want to).
         # Here we just allocate once; if you want zero-allocation, replace with a custom Triton kernel.
-        Omega = torch.randn(n, b, device=device, dtype=dtype)
-        Y = A @ Omega
+        Omega = torch.randn(n, b, device=device, dtype=torch.float32 if cpu_amp else dtype)
+        Y = matmul(Omega).to(dtype)
 
     # Optional power iterations (stabilize subspace)
     for _ in range(q_iter):
         with amp_ctx():
             # Z = A^T @ Y   (n x b)
-            Z = A.T @ Y
+            Z = rmatmul(Y).to(dtype)
             # orthonormalize Z cheaply
             Z, _ = torch.linalg.qr(Z, mode="reduced")  # small (n x b)
             # Y = A @ Z
-            Y = A @ Z
+            Y = matmul(Z).to(dtype)
 
     # ---- thin QR: keep only R; never materialize Q ----
     # operate in fp32 for stability
-    if use_amp:
+    if use_amp and not cpu_amp:
       Y_32 = Y.float()
     else:
       Y_32 = Y #not changed
@@ -99,7 +134,7 @@ def randomized_svd_tsolve_stream(
     for i0 in range(0, m, block_rows):
         i1 = min(i0 + block_rows, m)
         Yi = Y_32[i0:i1]        # (rows x b)
-        Ai = A[i0:i1] if not use_amp else A[i0:i1].float() # (rows x n) in fp32 for accuracy
+        Ai = A[i0:i1] if not use_amp or cpu_amp else A[i0:i1].float() # (rows x n) in fp32 for accuracy
         C.add_(Yi.T @ Ai)      # accumulate
 
     # ---- B = R^{-T} @ C  via triangular solve ----
@@ -0,0 +1,265 @@
+import torch
+import numpy as np
+import gc
+from torch_utils import as_tensor, get_device
+from torch_linop import DenseOperator, ScaledOperator, randomized_svd_linop
+
+class PCAState:
+    """
+    Persisted state of an incremental PCA: the truncated SVD of the column centered (and
+    optionally scaled) data, A_z = U diag(S) Vh, plus the running column mean, variance
+    and row count needed to fold in more data later.
+
+    Rows are samples and columns features, as in `FastPCA()` after any transpose. U can be
+    dropped (`keep_u = False`) when only the loadings are needed; updates then cost
+    O(new_rows * n_features * k) regardless of how many rows were seen before.
+
+    All arrays are kept as NumPy so the state can be saved, loaded and handed to R.
+    """
+    def __init__(self, U, S, Vh, mean, var, count, n_components=None, scale=1, log2=0):
+        self.U = U
+        self.S = S
+        self.Vh = Vh
+        self.mean = mean
+        self.var = var
+        self.count = int(count)
+        self.n_components = int(n_components if n_components is not None else S.shape[0])
+        self.scale = int(scale)
+        self.log2 = int(log2)
+
+    def save(self, path):
+        """
+        Saves the state to a `.npz` file.
+        """
+        arrays = dict(S=self.S, Vh=self.Vh, mean=self.mean, var=self.var,
+                      meta=np.array([self.count, self.n_components, self.scale, self.log2]))
+        if self.U is not None:
+            arrays["U"] = self.U
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a state written by `save`.
+        """
+        with np.load(path) as f:
+            count, n_components, scale, log2 = (int(v) for v in f["meta"])
+            U = f["U"] if "U" in f.files else None
+            return cls(U, f["S"], f["Vh"], f["mean"], f["var"], count,
+                       n_components=n_components, scale=scale, log2=log2)
+
+    def update_rows(self, new_rows, block_size: int = None, device: str = "cpu", cores: int = 2):
+        """
+        Folds new samples (rows) into the decomposition with a Brand-style low-rank update.
+
+        New rows are processed `block_size` at a time. For each block the running mean and
+        variance are combined (Chan et al.), the existing factors are re-expressed for the new
+        centering and scaling, and only a matrix of at most (k + b + 1) rows and columns is
+        decomposed, so the cost is linear in the number of new rows.
+
+        Args:
+            new_rows: NumPy array (new samples x features), untransformed like the data the
+                      state was fitted on (log2 is applied here when the state uses it).
+            block_size: Rows folded in per step (default: 2 * k).
+            device: "CPU" or "GPU".
+            cores: CPU threads.
+
+        Returns:
+            The updated state (self).
+        """
+        device = get_device(device, cores)
+        B_all = as_tensor(new_rows, verbose=False).to(device)
+        if B_all.shape[1] != self.Vh.shape[1]:
+            raise ValueError(f"new rows have {B_all.shape[1]} columns, the state has {self.Vh.shape[1]}")
+        if self.log2 == 1:
+            B_all = torch.log2(B_all)
+        dtype = torch.from_numpy(self.Vh).dtype
+        B_all = B_all.to(dtype)
+        block_size = block_size or max(2 * self.n_components, 1)
+
+        U = None if self.U is None else torch.from_numpy(self.U).to(device)
+        S = torch.from_numpy(self.S).to(device)
+        Vh = torch.from_numpy(self.Vh).to(device)
+        mean = torch.from_numpy(self.mean).to(device)
+        M2 = torch.from_numpy(self.var).to(device) * max(self.count - 1, 0)
+        n = self.count
+        for i0 in range(0, B_all.shape[0], block_size):
+            B = B_all[i0:i0 + block_size]
+            n_b = B.shape[0]
+            n_new = n + n_b
+            mean_b = B.mean(dim=0)
+            delta = mean_b - mean
+            mean_new = mean + delta * (n_b / n_new)
+            M2_new = M2 + (B - mean_b).square().sum(dim=0) + delta.square() * (n * n_b / n_new)
+            std_new = _safe_std(M2_new, n_new) if self.scale == 1 else torch.ones_like(mean)
+            if self.scale == 1:
+                #old factors were scaled by the old std, rescale them to the new one
+                U, S, Vh = _rescale_columns(U, S, Vh, _safe_std(M2, n) / std_new)
+            #the old rows are off by (mean - mean_new) after recentering; that rank-one shift
+            #lives on the direction 1/sqrt(n), which is orthogonal to U since U's columns sum to 0
+            shift = ((mean - mean_new) * np.sqrt(n) / std_new).unsqueeze(0)
+            rows = torch.cat([shift, (B - mean_new) / std_new], dim=0)
+            U_k, S, Vh = _append_rows(S, Vh, rows, self.n_components)
+            if U is not None:
+                k = U.shape[1]
+                U_top = U @ U_k[:k] + U_k[k].unsqueeze(0) / np.sqrt(n)
+                U = torch.cat([U_top, U_k[k + 1:]], dim=0)
+            mean, M2, n = mean_new, M2_new, n_new
+
+        self.U = None if U is None else U.to("cpu").numpy()
+        self.S = S.to("cpu").numpy()
+        self.Vh = Vh.to("cpu").numpy()
+        self.mean = mean.to("cpu").numpy()
+        self.var = (M2 / max(n - 1, 1)).to("cpu").numpy()
+        self.count = n
+        del B_all
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+        gc.collect()
+        return self
+
+    def update_columns(self, new_cols, device: str = "cpu", cores: int = 2):
+        """
+        Appends new features (columns) measured on the same samples.
+
+        The new columns are centered (and scaled) with their own statistics, projected onto U
+        and the residual orthonormalized, so only a matrix of at most (k + c) rows and columns is
+        decomposed. Requires U (`keep_u = True`).
+
+        Args:
+            new_cols: NumPy array (samples x new features) with one row per sample seen so far.
+            device: "CPU" or "GPU".
+            cores: CPU threads.
+
+        Returns:
+            The updated state (self).
+        """
+        if self.U is None:
+            raise ValueError("adding columns needs the left singular vectors; fit with keep_u = 1")
+        device = get_device(device, cores)
+        C = as_tensor(new_cols, verbose=False).to(device)
+        if C.shape[0] != self.count:
+            raise ValueError(f"new columns have {C.shape[0]} rows, the state has {self.count}")
+        if self.log2 == 1:
+            C = torch.log2(C)
+        dtype = torch.from_numpy(self.Vh).dtype
+        C = C.to(dtype)
+        mean_c = C.mean(dim=0)
+        var_c = C.var(dim=0) if self.count > 1 else torch.zeros_like(mean_c)
+        Cz = C - mean_c
+        if self.scale == 1:
+            Cz = Cz.div_(_safe_std(var_c * max(self.count - 1, 0), self.count))
+
+        U = torch.from_numpy(self.U).to(device)
+        S = torch.from_numpy(self.S).to(device)
+        Vh = torch.from_numpy(self.Vh).to(device)
+        k, c = S.shape[0], Cz.shape[1]
+        #project on U twice so the residual stays orthogonal to it
+        P = U.T @ Cz
+        R = Cz - U @ P
+        P2 = U.T @ R
+        R = R - U @ P2
+        P = P + P2
+        #with more new columns than samples R_c has fewer rows (q) than columns
+        Q_c, R_c = torch.linalg.qr(R)
+        q = Q_c.shape[1]
+        K = torch.zeros((k + q, k + c), device=device, dtype=dtype)
+        K[:k, :k] = torch.diag(S)
+        K[:k, k:] = P
+        K[k:, k:] = R_c
+        U_k, S_new, Wh = torch.linalg.svd(K, full_matrices=False)
+        r = min(self.n_components, S_new.shape[0])
+        U = U @ U_k[:k, :r] + Q_c @ U_k[k:, :r]
+        Vh = torch.cat([Wh[:r, :k] @ Vh, Wh[:r, k:]], dim=1)
+
+        self.U = U.to("cpu").numpy()
+        self.S = S_new[:r].to("cpu").numpy()
+        self.Vh = Vh.to("cpu").numpy()
+        self.mean = np.concatenate([self.mean, mean_c.to("cpu").numpy()])
+        self.var = np.concatenate([self.var, var_c.to("cpu").numpy()])
+        del C, Cz
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+        gc.collect()
+        return self
+
+def _safe_std(M2, n):
+    #constant columns get a scale of 1 rather than a division by zero
+    std = (M2 / max(n - 1, 1)).sqrt()
+    return torch.where(std > 0, std, torch.ones_like(std))
+
+def _rescale_columns(U, S, Vh, ratio):
+    #U diag(S) Vh diag(ratio) back to an SVD, through the QR of the k x n factor
+    Q, R = torch.linalg.qr((Vh * ratio).T)
+    U_s, S, Wh = torch.linalg.svd(S.unsqueeze(1) * R.T, full_matrices=False)
+    U = None if U is None else U @ U_s
+    return U, S, Wh @ Q.T
+
+def _append_rows(S, Vh, rows, n_components):
+    #[diag(S) Vh; rows] = [[diag(S), 0], [rows V, R_b^T]] [Vh; Q_b^T], with Q_b R_b the QR
+    #of the part of the new rows outside the row space of Vh
+    k, r = S.shape[0], rows.shape[0]
+    C = rows @ Vh.T
+    res = rows - C @ Vh
+    C2 = res @ Vh.T
+    res = res - C2 @ Vh
+    C = C + C2
+    #with more rows than features R_b is q x r with q = n_features < r
+    Q_b, R_b = torch.linalg.qr(res.T)
+    q = Q_b.shape[1]
+    K = torch.zeros((k + r, k + q), device=rows.device, dtype=rows.dtype)
+    K[:k, :k] = torch.diag(S)
+    K[k:, :k] = C
+    K[k:, k:] = R_b.T
+    U_k, S_new, Wh = torch.linalg.svd(K, full_matrices=False)
+    keep = min(n_components, S_new.shape[0])
+    Vh = Wh[:keep, :k] @ Vh + Wh[:keep, k:] @ Q_b.T
+    return U_k[:, :keep], S_new[:keep], Vh
+
+def incremental_pca_fit_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2,
+                           log2: int = 0, scale: int = 1, keep_u: int = 1,
+                           device: str = "cpu", cores: int = 2, orth: str = "qr"):
+    """
+    Fits the initial state of an incremental PCA with the randomized SVD.
+
+    The data are column centered (and with `scale` divided by the column standard deviations)
+    implicitly inside the matrix products, and the running statistics are stored so later
+    batches can be added with `PCAState.update_rows` / `update_columns`.
+
+    Args:
+        A_np: Input NumPy array (samples x features).
+        k: Number of components kept in the state.
+        p: Oversampling parameter.
+        q_iter: Number of power iterations.
+        log2: integer of 1 or 0 for whether to log2 transform the data (also applied to updates).
+        scale: integer of 1 or 0 for whether to scale the columns to unit variance.
+        keep_u: integer of 1 or 0 for whether to keep the left singular vectors (samples x k).
+        orth: Orthonormalizer, see torch_orth.py.
+
+    Returns:
+        A `PCAState`.
+    """
+    device = get_device(device, cores)
+    A = as_tensor(A_np).to(device)
+    if log2 == 1:
+        A = torch.log2(A)
+    mean = A.mean(dim=0)
+    M2 = (A.var(dim=0) if A.shape[0] > 1 else torch.zeros_like(mean)) * max(A.shape[0] - 1, 0)
+    std = _safe_std(M2, A.shape[0]) if scale == 1 else torch.ones_like(mean)
+    op = ScaledOperator(DenseOperator(A), mean, std)
+    U, S, Vh = randomized_svd_linop(op, k=k, p=p, q_iter=q_iter, orth=orth)
+    state = PCAState(U[:, :k].to("cpu").numpy() if keep_u == 1 else None,
+                     S[:k].to("cpu").numpy(), Vh[:k].to("cpu").numpy(),
+                     mean.to("cpu").numpy(), (M2 / max(A.shape[0] - 1, 1)).to("cpu").numpy(),
+                     A.shape[0], n_components=k, scale=scale, log2=log2)
+    del A, op, U, S, Vh
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    gc.collect()
+    return state
+
+def incremental_pca_load_py(path):
+    """
+    Loads a `PCAState` saved with `PCAState.save`.
+    """
+    return PCAState.load(path)
@@ -1,8 +1,13 @@
 import torch
 import numpy as np
 import gc
+import math
+import os
+from torch_utils import as_tensor, is_sparse
+from torch_svd_func_ooc import is_out_of_core, open_row_source
 
-def transform_py(A_np: np.ndarray, log2: int = 0, transpose: int = 0, scale: int = 1, cores: int = 2):
+def transform_py(A_np: np.ndarray, log2: int = 0, transpose: int = 0, scale: int = 1, cores: int = 2, return_stats: int = 0,
+                 block_rows: int = 0, out = None, inplace: int = 0, pseudocount: float = 0, drop_zero_var: int = 0):
     """
     Performs scaling and centering, and transposing the matrix.
 
@@ -12,33 +17,291 @@ def transform_py(A_np: np.ndarray, log2: int = 0, transpose: int = 0, scale: int
         log2: integer of 1 or 0 for whether to log transform the data
         transpose: integer of 1 or 0 for whether to tranpose the matrix.
         scale: integer of 1 or 0 for whether to mean center and unit variance transform the data. For whether to scale columns
+        return_stats: integer of 1 or 0 for whether to also return the column means and standard deviations
+                      used for scaling (None when scale is 0), so new samples can be scored the same way
+                      (see torch_pca_model.py).
+        block_rows: when > 0 (or when `out` is given or A_np is out of core) the transform is
+                    streamed in blocks of rows, see `transform_stream_py`.
+        out: output for the streamed transform: None, a writable array or a `.npy` path.
+        inplace: integer of 1 or 0 for whether to transform a single owned copy of the matrix in place
+                 (see `_transform_inplace`), keeping peak memory at about one copy of the input.
+        pseudocount: added before the log2 transform so zero counts stay finite; with 1 the
+                     transform is log2(1 + x), computed with log1p.
+        drop_zero_var: integer of 1 or 0 for whether to drop the columns with zero (or non-finite)
+                       variance after the log transform, found from the same column statistics.
 
     Returns:
-        NumPy arrays for the transformed data.
+        NumPy arrays for the transformed data, or a tuple of (A, mean, std) with `return_stats`.
+        With `drop_zero_var` the boolean mask of the kept columns is appended, and A, mean and std
+        only hold the kept columns.
     """
+    if block_rows > 0 or out is not None or is_out_of_core(A_np):
+      return transform_stream_py(A_np, log2 = log2, transpose = transpose, scale = scale, block_rows = block_rows or 10_000,
+                                 out = out, cores = cores, return_stats = return_stats, pseudocount = pseudocount,
+                                 drop_zero_var = drop_zero_var)
     
     torch.set_num_threads(cores)
     
-    A = torch.tensor(A_np)
+    if inplace == 1:
+      A, mean_vec, std_vec, keep = _transform_inplace(A_np, log2 = log2, transpose = transpose, scale = scale,
+                                                      pseudocount = pseudocount, drop_zero_var = drop_zero_var)
+      return _outputs(A, mean_vec, std_vec, keep, return_stats)
+    
+    A = as_tensor(A_np) #zero-copy view of the numpy/R memory when possible
     
     if log2 == 1:
-      A = torch.log2(A)
+      A = _log2(A, pseudocount, owned = False)
       
     if transpose == 1:
-      #A = torch.tensor(A).T
-      A = A.detach().clone().T
+      #a transposed view; the strides swap and no data is copied
+      A = A.T
+    
+    keep, mean_vec, std_vec = None, None, None
+    if scale == 1 or drop_zero_var == 1:
+      #one set of column statistics for both the zero-variance mask and the scaling
+      mean_vec, std_vec = A.mean(dim=0), A.std(dim=0)
+    if drop_zero_var == 1:
+      keep = _live_columns(mean_vec, std_vec)
+      mean_vec, std_vec = mean_vec[keep], std_vec[keep]
     
     if scale == 1:
-      #mean center
-      mean_vec = A.mean(dim=0)
-      A = A - mean_vec
-      #scale
-      std_vec = A.std(dim=0)
-      A = A / std_vec
+      #center, scale and drop in one step: the first operation makes the only new buffer, the others work in it
+      A = A[:, keep].sub_(mean_vec) if keep is not None else A - mean_vec
+      A = A.div_(std_vec)
+    else:
+      mean_vec, std_vec = None, None
+      if keep is not None:
+        A = A[:, keep]
     
     A = A.detach().numpy()
 
-    return A
+    if scale == 1:
+      mean_vec, std_vec = mean_vec.numpy(), std_vec.numpy()
+    return _outputs(A, mean_vec, std_vec, keep, return_stats)
+
+def _outputs(A, mean_vec, std_vec, keep, return_stats):
+    #return value of the transforms: A, plus the statistics with return_stats and the column mask with drop_zero_var
+    res = (A, mean_vec, std_vec) if return_stats == 1 else (A,)
+    if keep is not None:
+      res = res + (keep.numpy() if isinstance(keep, torch.Tensor) else keep,)
+    return res if len(res) > 1 else A
+
+def _log2(A: torch.Tensor, pseudocount: float = 0, owned: bool = True) -> torch.Tensor:
+    #log2(A + pseudocount), in place when A is a buffer we own. log1p keeps the precision of small
+    #counts for the common pseudo-count of 1
+    if pseudocount == 1:
+      A = A.log1p_() if owned else torch.log1p(A)
+      return A.div_(math.log(2))
+    if pseudocount != 0:
+      A = A.add_(pseudocount) if owned else A + pseudocount
+      owned = True
+    return A.log2_() if owned else torch.log2(A)
+
+def _live_columns(mean, std) -> torch.Tensor:
+    #columns with a finite, nonzero standard deviation. Constant columns (and -Inf from log2(0)) carry
+    #no information for the PCA and would divide by zero when scaling. A standard deviation at the
+    #round-off level of the mean (which the blockwise merge can leave for a constant column) counts as zero
+    mean, std = torch.as_tensor(mean), torch.as_tensor(std)
+    keep = torch.isfinite(std) & (std > math.sqrt(torch.finfo(std.dtype).eps) * mean.abs())
+    dropped = int((~keep).sum())
+    if dropped > 0:
+      print(f"Dropping {dropped} zero-variance or non-finite column(s)")
+    return keep
+
+def _transform_inplace(A_np, log2: int = 0, transpose: int = 0, scale: int = 1, pseudocount: float = 0,
+                       drop_zero_var: int = 0, block_elements: int = 2 ** 20):
+    #log2, centering and scaling of one owned buffer with log2_/sub_/div_, fused per block of output
+    #columns so each block is read once while it is in cache. The buffer takes the memory order of the
+    #input (column-major for R matrices) and the transpose is only a swap of its strides, never a copy.
+    #Returns the NumPy view of the buffer, the column means/standard deviations (None without scale)
+    #and the mask of kept columns (None without drop_zero_var)
+    A = as_tensor(A_np)
+    shared = _shares_memory(A, A_np)
+    if not shared:
+      #as_tensor already made a private copy (e.g. an integer matrix), work on it directly
+      buf = A
+    elif A.T.is_contiguous():
+      buf = torch.empty(A.shape[::-1], dtype = A.dtype).T
+    else:
+      buf = torch.empty(A.shape, dtype = A.dtype)
+    src = A.T if transpose == 1 else A
+    out = buf.T if transpose == 1 else buf
+    rows, cols = out.shape
+    block_cols = max(1, block_elements // max(rows, 1))
+    stats = scale == 1 or drop_zero_var == 1
+    mean_vec = torch.empty(cols, dtype = A.dtype) if stats else None
+    std_vec = torch.empty(cols, dtype = A.dtype) if stats else None
+    for j0 in range(0, cols, block_cols):
+      j1 = min(j0 + block_cols, cols)
+      block = out[:, j0:j1]
+      if shared:
+        block.copy_(src[:, j0:j1])
+      if log2 == 1:
+        _log2(block, pseudocount)
+      if stats:
+        mean_vec[j0:j1] = block.mean(dim=0)
+        std_vec[j0:j1] = block.std(dim=0)
+      if scale == 1:
+        block.sub_(mean_vec[j0:j1])
+        #dead columns are divided by 1 and dropped below
+        std = std_vec[j0:j1]
+        block.div_(torch.where(std > 0, std, torch.ones_like(std)) if drop_zero_var == 1 else std)
+    keep = None
+    if drop_zero_var == 1:
+      keep = _live_columns(mean_vec, std_vec)
+      out = _compact_columns(out, keep)
+      mean_vec, std_vec = mean_vec[keep], std_vec[keep]
+    if scale == 1:
+      mean_vec, std_vec = mean_vec.numpy(), std_vec.numpy()
+    else:
+      mean_vec, std_vec = None, None
+    return out.numpy(), mean_vec, std_vec, keep
+
+def _shares_memory(A: torch.Tensor, A_np) -> bool:
+    #whether as_tensor returned the caller's memory (a float tensor as is, a view of a NumPy array)
+    #rather than a copy of its own. Other inputs went through np.asarray, which may return a view too
+    if isinstance(A_np, torch.Tensor):
+      return A.data_ptr() == A_np.data_ptr()
+    if isinstance(A_np, np.ndarray):
+      return A.data_ptr() == A_np.__array_interface__["data"][0]
+    return True
+
+def _compact_columns(out: torch.Tensor, keep: torch.Tensor) -> torch.Tensor:
+    #moves the kept columns to the front of the buffer, left to right so no column is overwritten
+    #before it has been moved, and returns the view of the first ones (no second buffer)
+    idx = torch.nonzero(keep).flatten().tolist()
+    for k, j in enumerate(idx):
+      if k != j:
+        out[:, k].copy_(out[:, j])
+    return out[:, :len(idx)]
+
+def _row_blocks(source, transpose: int, block_rows: int, log2: int, dtype, pseudocount: float = 0):
+    #yields (i0, i1, block) over the rows of the (possibly transposed) matrix as float tensors;
+    #with transpose the rows are column slices of the source, which numpy, memmaps, HDF5 and Zarr all support
+    n_rows = source.shape[1] if transpose == 1 else source.shape[0]
+    for i0 in range(0, n_rows, block_rows):
+        i1 = min(i0 + block_rows, n_rows)
+        block = source[:, i0:i1].T if transpose == 1 else source[i0:i1]
+        #a C-ordered copy of one block (R matrices arrive column-major), so it can be modified in place
+        block = torch.from_numpy(np.array(block, dtype = dtype, order = "C"))
+        if log2 == 1:
+            _log2(block, pseudocount)
+        yield i0, i1, block
+
+def column_stats_stream(A_np, log2: int = 0, transpose: int = 0, block_rows: int = 10_000, dataset: str = None, cores: int = 2,
+                        pseudocount: float = 0):
+    """
+    Column means and variances in one streaming pass over blocks of rows.
+
+    Each block's mean and sum of squared deviations are merged into the running totals with
+    Chan et al.'s parallel update (the blockwise form of Welford's algorithm), which does not
+    suffer the cancellation of the sum / sum-of-squares formula. Memory is one block of rows.
+
+    Args:
+        A_np: NumPy array, np.memmap or path to a `.npy`/HDF5/Zarr matrix (see `open_row_source`).
+        log2: integer of 1 or 0 for whether the statistics are of the log2 transformed values.
+        transpose: integer of 1 or 0 for whether the statistics are of the columns of the transpose.
+        block_rows: Rows per block.
+        dataset: Dataset name for HDF5/Zarr inputs holding more than one matrix.
+        pseudocount: Added before the log2 transform (see `transform_py`).
+
+    Returns:
+        Tuple of (mean, var, count): NumPy column means, sample variances (n - 1 denominator, as
+        `torch.std`) and the number of rows.
+    """
+    torch.set_num_threads(cores)
+    source = open_row_source(A_np, dataset)
+    dtype = np.float32 if source.dtype == np.float32 else np.float64
+    n_cols = source.shape[0] if transpose == 1 else source.shape[1]
+    count = 0
+    mean = torch.zeros(n_cols, dtype = torch.float32 if dtype == np.float32 else torch.float64)
+    m2 = torch.zeros_like(mean)
+    for _, _, block in _row_blocks(source, transpose, max(1, int(block_rows)), log2, dtype, pseudocount):
+        b_count = block.shape[0]
+        b_mean = block.mean(dim = 0)
+        b_m2 = (block - b_mean).square_().sum(dim = 0)
+        delta = b_mean - mean
+        total = count + b_count
+        mean += delta * (b_count / total)
+        m2 += b_m2 + delta.square_() * (count * b_count / total)
+        count = total
+    var = m2 / max(count - 1, 1)
+    return mean.numpy(), var.numpy(), count
+
+def transform_stream_py(A_np, log2: int = 0, transpose: int = 0, scale: int = 1, block_rows: int = 10_000, out = None,
+                        mean: np.ndarray = None, std: np.ndarray = None, dataset: str = None, cores: int = 2,
+                        return_stats: int = 0, pseudocount: float = 0, drop_zero_var: int = 0):
+    """
+    Two-pass streaming version of `transform_py` for inputs that should not be copied whole.
+
+    The first pass computes the column statistics (`column_stats_stream`), the second writes the
+    log2 transformed, centered and scaled rows block by block into `out`. Peak memory is the
+    output plus one block, or just one block when `out` is a file. Precomputed `mean`/`std`
+    (e.g. from an earlier `return_stats`) skip the first pass. With `drop_zero_var` the dead
+    columns are found from the first pass and never written.
+
+    Args:
+        A_np: NumPy array, np.memmap or path to a `.npy`/HDF5/Zarr matrix.
+        log2: integer of 1 or 0 for whether to log transform the data
+        transpose: integer of 1 or 0 for whether to tranpose the matrix.
+        scale: integer of 1 or 0 for whether to mean center and unit variance transform the data.
+        block_rows: Rows of the output written per block.
+        out: None (a new array), a writable array of the output shape (A_np itself for an in-place
+             transform without transpose) or a path; a path is written as a `.npy` memmap.
+        mean, std: Optional column statistics of the (log2 transformed, transposed) matrix.
+        dataset: Dataset name for HDF5/Zarr inputs holding more than one matrix.
+        return_stats: integer of 1 or 0 for whether to also return the column means and standard deviations.
+        pseudocount: Added before the log2 transform (see `transform_py`).
+        drop_zero_var: integer of 1 or 0 for whether to drop the columns with zero (or non-finite) variance.
+
+    Returns:
+        The transformed matrix (np.ndarray or np.memmap), or a tuple of (A, mean, std) with `return_stats`,
+        followed by the mask of kept columns with `drop_zero_var`.
+    """
+    torch.set_num_threads(cores)
+    source = open_row_source(A_np, dataset)
+    if is_sparse(source):
+        raise ValueError("the streaming transform needs a dense matrix")
+    block_rows = max(1, int(block_rows))
+    dtype = np.float32 if source.dtype == np.float32 else np.float64
+    shape = (source.shape[1], source.shape[0]) if transpose == 1 else tuple(source.shape)
+
+    if (scale == 1 or drop_zero_var == 1) and (mean is None or std is None):
+        mean, var, _ = column_stats_stream(source, log2 = log2, transpose = transpose, block_rows = block_rows, cores = cores,
+                                           pseudocount = pseudocount)
+        std = np.sqrt(var)
+    keep = None
+    if drop_zero_var == 1:
+        keep = _live_columns(mean, std).numpy()
+        mean, std = mean[keep], std[keep]
+        shape = (shape[0], int(keep.sum()))
+    if scale != 1:
+        mean, std = None, None
+
+    if out is None:
+        result = np.empty(shape, dtype = dtype)
+    elif isinstance(out, (str, os.PathLike)):
+        result = np.lib.format.open_memmap(os.fspath(out), mode = "w+", dtype = dtype, shape = shape)
+    else:
+        if tuple(out.shape) != shape:
+            raise ValueError(f"`out` has shape {tuple(out.shape)}, expected {shape}")
+        result = out
+
+    if scale == 1:
+        mean_t = torch.as_tensor(mean, dtype = torch.float32 if dtype == np.float32 else torch.float64)
+        std_t = torch.as_tensor(std, dtype = mean_t.dtype)
+    keep_t = None if keep is None else torch.from_numpy(keep)
+    for i0, i1, block in _row_blocks(source, transpose, block_rows, log2, dtype, pseudocount):
+        if keep_t is not None:
+            block = block[:, keep_t]
+        if scale == 1:
+            block.sub_(mean_t).div_(std_t)
+        result[i0:i1] = block.numpy()
+    if isinstance(result, np.memmap):
+        result.flush()
+    gc.collect()
+
+    return _outputs(result, mean, std, keep, return_stats)
 
 # if __name__ == "__main__":
 #     import time
@@ -0,0 +1,149 @@
+import torch
+import numpy as np
+import gc
+from torch_utils import as_tensor, as_sparse_csr, get_device, is_sparse
+from torch_linop import DenseOperator, ScaledOperator, SparseOperator, randomized_svd_linop
+from torch_svd_func import adaptive_svd_linop
+from torch_transform import _live_columns, _log2
+
+def transform_svd_py(A_np: np.ndarray, k: int, p: int = 10, q_iter: int = 2,
+                     log2: int = 0, transpose: int = 0, scale: int = 1, implicit: int = 1,
+                     device: str = "cpu", cores: int = 2, orth: str = "qr",
+                     tol: float = None, target_variance: float = None, pseudocount: float = 0,
+                     drop_zero_var: int = 0):
+    """
+    Performs the `transform_py` preprocessing and Randomized SVD in one call.
+
+    The transformed matrix stays on the compute device and goes straight into the SVD,
+    instead of travelling back to R with `.numpy()` and being sent again. With `implicit`
+    the centering and scaling are applied inside the matmuls (see `ScaledOperator`), so the
+    scaled copy is never allocated: without log2 the only full-size matrix is the input itself.
+
+    Sparse input (scipy CSR/CSC, e.g. an R dgCMatrix, or a sparse torch tensor) is always scaled
+    implicitly, so memory scales with the number of nonzeros rather than m x n.
+
+    Args:
+        A_np: Input NumPy array or sparse matrix, oriented as for `transform_py`.
+        k: Number of singular values/vectors to compute.
+        p: Oversampling parameter.
+        q_iter: Number of power iterations.
+        log2: integer of 1 or 0 for whether to log transform the data. Not available for sparse input.
+        transpose: integer of 1 or 0 for whether to tranpose the matrix.
+        scale: integer of 1 or 0 for whether to mean center and unit variance transform the data.
+        implicit: integer of 1 or 0 for whether to center and scale inside the matmuls (1) or
+                  to scale a working copy on the device (0).
+        orth: Orthonormalizer, see torch_orth.py.
+        tol, target_variance: When either is given the rank is chosen adaptively with k as the
+              maximum rank and p as the block size (see `randomized_svd_adaptive_py`).
+        pseudocount: added before the log2 transform, as in `transform_py`.
+        drop_zero_var: integer of 1 or 0 for whether to leave out the columns with zero (or non-finite)
+                       variance, found from the same column statistics as the scaling. The scaled operator
+                       gives them a weight of zero, so no reduced copy of the matrix is made.
+
+    Returns:
+        Tuple of (U, S, Vh, mean, std) as NumPy arrays. U, S and Vh have k + p components like
+        `randomized_svd_py`; mean and std are the column statistics used for scaling (None
+        when scale is 0) so new samples can be projected the same way. In adaptive mode U, S and
+        Vh are truncated to the chosen rank and the rank and estimated relative error are appended.
+        With `drop_zero_var` the boolean mask of the kept columns is appended, and Vh, mean and std
+        only hold the kept columns.
+    """
+    device = get_device(device, cores)
+    if is_sparse(A_np):
+      return _transform_svd_sparse(A_np, k, p, q_iter, log2, transpose, scale, device, orth, tol, target_variance,
+                                   drop_zero_var)
+
+    A = as_tensor(A_np).to(device)
+    #the buffer is ours to modify when log2 or the move to the GPU already copied it, never the caller's memory
+    owned = log2 == 1 or A.device.type == "cuda"
+
+    if log2 == 1:
+      #first (and only) full-size allocation, made directly on the compute device
+      A = _log2(A, pseudocount, owned = A.device.type == "cuda")
+
+    if transpose == 1:
+      A = A.T
+
+    keep, mean_vec, std_vec = None, None, None
+    if scale == 1 or drop_zero_var == 1:
+      #one set of column statistics for both the zero-variance mask and the scaling
+      mean_vec, std_vec = A.mean(dim=0), A.std(dim=0)
+    if drop_zero_var == 1:
+      keep = _live_columns(mean_vec, std_vec)
+      if not torch.isfinite(mean_vec[~keep]).all():
+        #-Inf from log2(0) would turn the products into NaN even with a weight of zero
+        A = A.masked_fill_(~keep, 0) if owned else A.masked_fill(~keep, 0)
+        owned = True
+    elif scale == 1 and not torch.isfinite(std_vec).all():
+      raise ValueError("the matrix has non-finite values (e.g. log2 of zero counts); set `pseudocount` or `drop_zero_var`")
+
+    if scale == 1 and implicit == 1:
+      op = ScaledOperator(DenseOperator(A), mean_vec, std_vec, keep = keep)
+      std_vec = op.std
+    elif scale == 1:
+      #scale in place when we already own the buffer
+      if keep is not None:
+        A, mean_vec, std_vec, owned = A[:, keep], mean_vec[keep], std_vec[keep], True
+      std_vec = torch.where(std_vec > 0, std_vec, torch.ones_like(std_vec))
+      A = A.sub_(mean_vec).div_(std_vec) if owned else (A - mean_vec).div_(std_vec)
+      op = DenseOperator(A)
+    else:
+      #uncentered, so the dropped columns are really left out
+      op = DenseOperator(A if keep is None or bool(keep.all()) else A[:, keep])
+
+    del A
+    return _run_svd(op, k, p, q_iter, scale, mean_vec, std_vec, device, orth, tol, target_variance, keep)
+
+def _transform_svd_sparse(A, k, p, q_iter, log2, transpose, scale, device, orth, tol, target_variance, drop_zero_var):
+    if log2 == 1:
+      raise ValueError("log2 would turn the zeros of a sparse matrix into -Inf; log transform its nonzero values before calling")
+    X, Xt = as_sparse_csr(A, device)
+    if transpose == 1:
+      X, Xt = Xt, X
+    op = SparseOperator(X, Xt)
+    keep, mean_vec, std_vec = None, None, None
+    if scale == 1 or drop_zero_var == 1:
+      mean_vec, std_vec = op.column_stats()
+    if drop_zero_var == 1:
+      keep = _live_columns(mean_vec, std_vec)
+    if scale == 1:
+      op = ScaledOperator(op, mean_vec, std_vec, keep = keep)
+      #all-zero columns are scaled by 1, report that scale for new samples
+      std_vec = op.std
+    elif keep is not None and not bool(keep.all()):
+      #uncentered, so the dropped columns are really left out
+      idx = keep.nonzero().squeeze(1)
+      op = SparseOperator(X.to_sparse_coo().index_select(1, idx).to_sparse_csr(),
+                          Xt.to_sparse_coo().index_select(0, idx).to_sparse_csr())
+    return _run_svd(op, k, p, q_iter, scale, mean_vec, std_vec, device, orth, tol, target_variance, keep)
+
+def _run_svd(op, k, p, q_iter, scale, mean_vec, std_vec, device, orth, tol, target_variance, keep = None):
+    adaptive = tol is not None or target_variance is not None
+    if adaptive:
+      U, S, Vh, rank, error = adaptive_svd_linop(op, max_rank = k, block_size = p, q_iter = q_iter,
+                                                 tol = tol, target_variance = target_variance, orth = orth)
+    else:
+      U, S, Vh = randomized_svd_linop(op, k = k, p = p, q_iter = q_iter, orth = orth)
+
+    #return results
+    U = U.to("cpu").numpy()
+    S = S.to("cpu").numpy()
+    Vh = Vh.to("cpu").numpy()
+    if keep is not None:
+      keep = keep.to("cpu").numpy()
+      #the scaled operator leaves the dropped columns in place with a weight of zero
+      if Vh.shape[1] == keep.shape[0]:
+        Vh = Vh[:, keep]
+    if scale == 1:
+      mean_vec = mean_vec.to("cpu").numpy()
+      std_vec = std_vec.to("cpu").numpy()
+      if keep is not None and mean_vec.shape[0] == keep.shape[0]:
+        mean_vec, std_vec = mean_vec[keep], std_vec[keep]
+    else:
+      mean_vec, std_vec = None, None
+    del op
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    gc.collect()
+    res = (U, S, Vh, mean_vec, std_vec) + ((rank, error) if adaptive else ())
+    return res + (keep,) if keep is not None else res
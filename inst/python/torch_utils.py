@@ -0,0 +1,115 @@
+import torch
+import numpy as np
+import warnings
+
+def get_device(device: str = "cpu", cores: int = 2):
+    """
+    Resolves the user supplied device string to a torch device.
+
+    Args:
+        device: "CPU" or "GPU" (case insensitive), as passed down from R.
+        cores: Number of CPU threads to use when computing on the CPU.
+
+    Returns:
+        torch.device to compute on.
+    """
+    if device.lower() == "gpu":
+      if torch.cuda.is_available():
+        return torch.device("cuda")
+      print("CUDA supplied as device but not available to pytorch;\nFalling back to CPU for computation")
+    #set number of cores to user given
+    torch.set_num_threads(cores)
+    return torch.device("cpu")
+
+def as_tensor(A_np, verbose: bool = True) -> torch.Tensor:
+    """
+    Wraps an input matrix as a floating point torch tensor, without copying whenever possible.
+
+    reticulate hands R matrices over as Fortran-ordered (column-major) NumPy arrays that point at
+    R's own memory. torch.from_numpy keeps those strides, so the tensor is a strided view of the
+    same buffer and no transpose copy is needed: matmuls, reductions and `.T` all work on it directly.
+    A copy is only made for negative or unaligned strides, non floating point dtypes (R integer or
+    logical matrices) and non-NumPy inputs; it is reported when `verbose` is set.
+
+    The returned tensor may share memory with the caller (and R), so it must never be modified in place.
+
+    Args:
+        A_np: NumPy array (or anything np.asarray understands) from R or Python.
+        verbose: Whether to print a note when the input had to be copied.
+
+    Returns:
+        torch.Tensor of a floating point dtype.
+    """
+    if isinstance(A_np, torch.Tensor):
+        return A_np if A_np.is_floating_point() else A_np.to(torch.float64)
+    reason = None
+    if not isinstance(A_np, np.ndarray):
+        reason = f"input of type {type(A_np).__name__} is not a NumPy array"
+        A_np = np.asarray(A_np)
+    if A_np.dtype.kind != "f" or A_np.dtype.byteorder == ">":
+        reason = reason or f"dtype {A_np.dtype} has no zero-copy floating point view"
+        A_np = A_np.astype(np.float64)
+    elif any(s < 0 or s % A_np.itemsize for s in A_np.strides):
+        reason = reason or "array strides are negative or not a multiple of the item size"
+        A_np = np.ascontiguousarray(A_np)
+    if reason is not None and verbose:
+        print(f"Copying input matrix ({A_np.nbytes / 1e9:.2f} GB): {reason}")
+    #arrays backed by R's memory are flagged read-only; we only ever read from them
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.from_numpy(A_np)
+
+def is_sparse(A) -> bool:
+    """
+    Whether A is a scipy.sparse matrix or a sparse torch tensor.
+    """
+    if isinstance(A, torch.Tensor):
+        return A.layout != torch.strided
+    try:
+        import scipy.sparse
+    except ImportError:
+        return False
+    return scipy.sparse.issparse(A)
+
+def _csr_tensor(indptr, indices, data, shape):
+    #sparse CSR support in torch is flagged as beta; keep the warning out of the R console
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.sparse_csr_tensor(indptr, indices, data, size = shape)
+
+def as_sparse_csr(A, device: torch.device = torch.device("cpu")):
+    """
+    Converts a sparse matrix to the pair of torch CSR tensors (X, X.T) used by `SparseOperator`.
+
+    scipy CSR/CSC arrays are wrapped with torch.from_numpy, so one of the two is a zero-copy
+    view (CSC of X is CSR of X.T, which is how R's dgCMatrix arrives). Only the other
+    orientation is built, so memory is about 2 x nnz instead of m x n.
+
+    Args:
+        A: scipy.sparse matrix (CSR, CSC or anything with .tocsr()) or a sparse torch tensor.
+        device: torch device to place the tensors on.
+
+    Returns:
+        Tuple of (X_csr, Xt_csr) floating point sparse CSR tensors.
+    """
+    if isinstance(A, torch.Tensor):
+        A = A.to(device)
+        if not A.is_floating_point():
+            A = A.to(torch.float64)
+        return A.to_sparse_csr(), A.t().to_sparse_csr()
+    if A.dtype.kind != "f":
+        A = A.astype(np.float64)
+    def wrap(M, shape):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            parts = [torch.from_numpy(np.asarray(x)) for x in (M.indptr, M.indices, M.data)]
+        return _csr_tensor(*parts, shape).to(device)
+    m, n = A.shape
+    if A.format == "csc":
+        Xt = wrap(A, (n, m))
+        X = wrap(A.tocsr(), (m, n))
+    else:
+        A = A.tocsr()
+        X = wrap(A, (m, n))
+        Xt = wrap(A.T.tocsr(), (n, m))
+    return X, Xt
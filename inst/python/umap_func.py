@@ -1,5 +1,5 @@
-import umap
 import numpy as np
+import warnings
 
 def umap_learn_py(matrix: np.ndarray, 
                   n_neighbors: int = 15, 
@@ -10,7 +10,16 @@ def umap_learn_py(matrix: np.ndarray,
                   seed: int = 4,
                   densemap: int = 0,
                   dens_lambda: float = 2.0,
-                  verbose: int = 0):
+                  verbose: int = 0,
+                  knn_cache: str = None,
+                  knn_cache_size: int = 8,
+                  knn_method: str = "auto",
+                  deterministic: int = 0,
+                  model_path: str = None,
+                  landmarks: int = 0,
+                  landmark_method: str = "kmeans++",
+                  landmark_placement: str = "transform",
+                  chunk_rows: int = 10_000):
   """
   Calculates the UMAP embedding .
 
@@ -22,10 +31,32 @@ def umap_learn_py(matrix: np.ndarray,
       metric: The metric to use to compute distances in high dimensional space.
       min_dist: The effective minimum distance between embedded points.
       cores: The number or CPU cores to use
+      knn_cache: Directory of a nearest-neighbor graph cache (see umap_knn.py). The graph of
+                 `matrix` is computed once and reused by later runs with other `min_dist`,
+                 `n_components` or `densemap` settings; None recomputes it every time.
+      knn_cache_size: Largest number of graphs kept in `knn_cache`.
+      knn_method: "nndescent" (umap-learn's approximate search), "exact" (tiled brute force in
+                  torch on `cores` threads, for the euclidean, cosine and correlation metrics) or
+                  "auto" ("exact" when `deterministic` and the metric allows it, else "nndescent").
+      deterministic: integer of 1 or 0. With 1 the embedding is the same on every run with the same
+                     `seed`, while still using `cores` threads: the kNN graph is computed
+                     deterministically (exact, or NN-descent on one thread) and the layout is
+                     optimized with `umap_reproducible.ReproducibleUMAP`. Requires a seed.
+      model_path: Optional `.npz` path to save the fitted model (`umap_model.UMAPModel`) to, for
+                  embedding new samples later with `umap_model.umap_transform_py`.
+      landmarks: Number of rows to fit UMAP on (0 for all). The other rows are placed into the
+                 landmark embedding afterwards (see umap_landmarks.py), so the cost of the fit is
+                 bounded by the number of landmarks.
+      landmark_method: "kmeans++", "stratified" or "random" choice of the landmarks.
+      landmark_placement: "transform" (short optimization per row) or "interpolate" (neighbor
+                          weighted mean of the landmark coordinates) for the other rows.
+      chunk_rows: Rows placed at a time in landmark mode.
 
   Returns:
       A NumPy array of shape (samples, n_components) containing the UMAP embedding.
   """
+  #imported here so loading this module does not pay for umap/numba until it is used
+  import umap
   #convert densemap back
   if densemap == 1:
     densemap = True
@@ -36,8 +67,50 @@ def umap_learn_py(matrix: np.ndarray,
   else:
     verbose = False
   
+  if deterministic == 1 and seed == -1:
+    raise ValueError("deterministic UMAP needs a seed")
+  from umap_knn import EXACT_METRICS
+  if knn_method == "auto":
+    knn_method = "exact" if deterministic == 1 and metric in EXACT_METRICS else "nndescent"
+  
+  #landmark mode: fit on a subset of the rows and place the others afterwards
+  full_matrix, landmark_rows = matrix, None
+  if 0 < landmarks < matrix.shape[0]:
+    from umap_landmarks import select_landmarks
+    landmark_rows = select_landmarks(matrix, landmarks, method = landmark_method, seed = seed, cores = cores)
+    if verbose:
+      print(f"Fitting UMAP on {len(landmark_rows)} landmarks ({landmark_method})")
+    matrix = np.ascontiguousarray(full_matrix[landmark_rows])
+  
+  #nearest neighbors from the cache or the exact engine, handed to umap-learn as a precomputed graph
+  precomputed_knn = (None, None, None)
+  if knn_cache is not None or knn_method != "nndescent" or deterministic == 1 or model_path is not None \
+      or landmark_rows is not None:
+    from umap_knn import get_knn
+    #seeded NN-descent is only reproducible on one thread (its threads share a random state)
+    knn_cores = 1 if deterministic == 1 and knn_method == "nndescent" else cores
+    indices, dists = get_knn(matrix, n_neighbors = n_neighbors, metric = metric, cores = knn_cores, seed = seed,
+                             method = knn_method, cache_dir = knn_cache, cache_size = knn_cache_size,
+                             verbose = int(verbose))
+    precomputed_knn = (indices, dists, None)
+  
   #umap model
-  if seed == -1 or cores > 1:
+  if deterministic == 1:
+    from umap_reproducible import ReproducibleUMAP
+    umap_model = ReproducibleUMAP(
+      layout_threads = cores,
+      n_neighbors=n_neighbors,
+      n_components=n_components,
+      min_dist=min_dist,
+      metric=metric,
+      n_jobs=1,
+      random_state = seed,
+      densmap = densemap,
+      dens_lambda = dens_lambda,
+      verbose = verbose,
+      precomputed_knn = precomputed_knn
+  )
+  elif seed == -1 or cores > 1:
     print("Parallel calculation - Seed unavailable")
     umap_model = umap.UMAP(
       n_neighbors=n_neighbors,
@@ -47,7 +120,8 @@ def umap_learn_py(matrix: np.ndarray,
       n_jobs=cores,
       densmap = densemap,
       dens_lambda = dens_lambda,
-      verbose = verbose
+      verbose = verbose,
+      precomputed_knn = precomputed_knn
   )
   else: umap_model = umap.UMAP(
       n_neighbors=n_neighbors,
@@ -58,10 +132,29 @@ def umap_learn_py(matrix: np.ndarray,
       random_state = seed,
       densmap = densemap,
       dens_lambda = dens_lambda,
-      verbose = verbose
+      verbose = verbose,
+      precomputed_knn = precomputed_knn
   )
   
   
-  embedding = umap_model.fit_transform(matrix)
+  with warnings.catch_warnings():
+    #a precomputed graph has no search index; only transform() needs one and the model is not kept
+    warnings.filterwarnings("ignore", message = "precomputed_knn")
+    embedding = umap_model.fit_transform(matrix)
+  
+  if model_path is not None or landmark_rows is not None:
+    from umap_model import UMAPModel
+    model = UMAPModel.from_umap(umap_model, matrix, indices, dists)
+    if model_path is not None:
+      model.save(model_path)
+  
+  if landmark_rows is not None:
+    from umap_landmarks import place_points
+    rest = np.setdiff1d(np.arange(full_matrix.shape[0]), landmark_rows, assume_unique = True)
+    full_embedding = np.empty((full_matrix.shape[0], embedding.shape[1]), dtype = np.float32)
+    full_embedding[landmark_rows] = embedding
+    full_embedding[rest] = place_points(model, full_matrix, rest, placement = landmark_placement,
+                                        chunk_rows = chunk_rows, cores = cores, seed = seed, verbose = int(verbose))
+    embedding = full_embedding
   
   return embedding
@@ -0,0 +1,233 @@
+import glob
+import hashlib
+import os
+import re
+import numpy as np
+
+#name of a complete cache entry; temporary files end in .tmp and never match
+_ENTRY = re.compile(r"_k(\d+)\.npz$")
+
+class KNNCache:
+    """
+    On-disk cache of k-nearest-neighbor graphs, shared across UMAP runs.
+
+    Each graph is one `.npz` file (indices and distances) named after a hash of the input
+    matrix, the metric, the neighbor engine (with the seed and thread count for NN-descent) and the
+    number of neighbors. A graph with more neighbors than requested
+    is reused by keeping its first columns, so a cache built with n_neighbors = 30 also serves
+    15. Reading a graph refreshes its modification time and the least recently used files are
+    removed beyond `max_entries`.
+    """
+    def __init__(self, cache_dir: str, max_entries: int = 8):
+        self.cache_dir = os.fspath(cache_dir)
+        self.max_entries = max(1, int(max_entries))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, data_hash: str, tag: str, n_neighbors: int) -> str:
+        return os.path.join(self.cache_dir, f"{data_hash}_{tag}_k{n_neighbors}.npz")
+
+    def get(self, data_hash: str, tag: str, n_neighbors: int):
+        """
+        Returns (indices, distances) with `n_neighbors` columns, or None when no cached graph has enough neighbors.
+        """
+        best = None
+        for path in glob.glob(os.path.join(self.cache_dir, f"{data_hash}_{tag}_k*.npz")):
+            match = _ENTRY.search(path)
+            if match is None:
+                continue
+            k = int(match.group(1))
+            if k >= n_neighbors and (best is None or k < best[0]):
+                best = (k, path)
+        if best is None:
+            return None
+        try:
+            with np.load(best[1]) as f:
+                indices, dists = f["indices"][:, :n_neighbors], f["dists"][:, :n_neighbors]
+        except (OSError, ValueError, KeyError):
+            #a corrupted entry, or one evicted by another process meanwhile, is recomputed
+            return None
+        try:
+            os.utime(best[1])
+        except OSError:
+            pass
+        return np.ascontiguousarray(indices), np.ascontiguousarray(dists)
+
+    def put(self, data_hash: str, tag: str, indices: np.ndarray, dists: np.ndarray):
+        """
+        Stores a graph and evicts the least recently used entries beyond `max_entries`.
+        """
+        path = self._path(data_hash, tag, indices.shape[1])
+        #write under a temporary name outside the entry pattern, so concurrent readers never see a partial
+        #file and other writers never evict it; a file object stops np.savez from appending .npz
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, indices=indices, dists=dists)
+        os.replace(tmp, path)
+        entries = []
+        for entry in glob.glob(os.path.join(self.cache_dir, "*_k*.npz")):
+            try:
+                if _ENTRY.search(entry):
+                    entries.append((os.path.getmtime(entry), entry))
+            except OSError:
+                pass
+        entries = [entry for _, entry in sorted(entries)]
+        for old in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+def data_hash(X: np.ndarray) -> str:
+    """
+    Content hash of a matrix (values, shape and dtype), used as the cache key.
+    """
+    X = np.ascontiguousarray(X)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((X.shape, X.dtype.str)).encode())
+    h.update(memoryview(X).cast("B"))
+    return h.hexdigest()
+
+#metrics of the exact engine
+EXACT_METRICS = ("euclidean", "cosine", "correlation")
+
+def exact_knn_torch(X: np.ndarray, n_neighbors: int = 15, metric: str = "euclidean", cores: int = 4, device: str = "cpu",
+                    memory_budget_mb: float = None, tile_rows: int = 0, queries: np.ndarray = None, verbose: int = 0):
+    """
+    Exact k-nearest-neighbor graph by brute force in torch.
+
+    The query rows are processed in tiles: the distances of a tile to all samples come from one
+    matrix product (|x|^2 + |y|^2 - 2 x.y for euclidean, 1 - x.y of the normalized rows for
+    cosine and correlation) and `torch.topk` keeps the nearest `n_neighbors`. For the few
+    dimensions of PC scores this is a handful of large, well threaded products instead of the
+    irregular memory access of NN-descent, and the result does not depend on a seed. Each sample
+    is returned as its own first neighbor at distance 0, as NN-descent does. With `queries`, the
+    neighbors of those rows among the samples of X are returned instead (X is the search index).
+
+    Args:
+        X: Matrix of shape (samples, features), e.g. PC scores.
+        n_neighbors: Number of neighbors per sample (including the sample itself).
+        metric: "euclidean", "cosine" or "correlation".
+        cores: Number of CPU threads.
+        device: "CPU" or "GPU".
+        memory_budget_mb: Memory allowed for one tile of distances; default a quarter of the free memory.
+        tile_rows: Query rows per tile; 0 derives it from `memory_budget_mb`.
+        queries: Optional matrix of new samples (rows) with the same features as X.
+
+    Returns:
+        Tuple of (indices, distances), each of shape (queries or samples, n_neighbors), as int32 and float32.
+    """
+    import torch
+    from torch_autotune import available_memory
+    from torch_utils import as_tensor, get_device
+    if metric not in EXACT_METRICS:
+        raise ValueError(f"metric '{metric}' is not supported by the exact kNN; use one of {', '.join(EXACT_METRICS)}")
+    device = get_device(device, cores)
+    def prepare(M):
+        M = as_tensor(M, verbose = verbose == 1).to(device)
+        if metric == "correlation":
+            M = M - M.mean(dim=1, keepdim=True)
+        if metric == "euclidean":
+            return M.contiguous()
+        #rows with zero norm stay zero and end up at distance 1 from everything, as in pynndescent
+        return M / M.norm(dim=1, keepdim=True).clamp_min(torch.finfo(M.dtype).tiny)
+
+    with torch.no_grad():
+        Y = prepare(X)
+        Q = Y if queries is None else prepare(queries).to(Y.dtype)
+        if Q.shape[1] != Y.shape[1]:
+            raise ValueError(f"queries have {Q.shape[1]} columns, the samples have {Y.shape[1]}")
+        n, m = Y.shape[0], Q.shape[0]
+        k = min(int(n_neighbors), n)
+        if metric == "euclidean":
+            sq = (Y * Y).sum(dim=1)
+            sq_q = sq if queries is None else (Q * Q).sum(dim=1)
+        if tile_rows <= 0:
+            budget = memory_budget_mb * 2 ** 20 if memory_budget_mb is not None else (available_memory(device) or 2 ** 30) / 4
+            #the distance tile plus the values and indices topk sorts through, about 3 rows of n per query
+            tile_rows = int(budget // (3 * n * Y.element_size()))
+        tile_rows = max(1, min(m, int(tile_rows)))
+        if verbose == 1:
+            print(f"Exact {k}-nearest neighbors in tiles of {tile_rows} rows")
+
+        indices = np.empty((m, k), dtype=np.int32)
+        dists = np.empty((m, k), dtype=np.float32)
+        for i0 in range(0, m, tile_rows):
+            i1 = min(i0 + tile_rows, m)
+            D = Q[i0:i1] @ Y.T
+            if metric == "euclidean":
+                D.mul_(-2).add_(sq_q[i0:i1, None]).add_(sq[None, :])
+            else:
+                D.neg_().add_(1)
+            if queries is None:
+                #put each sample ahead of exact duplicates
+                rows = torch.arange(i1 - i0, device=device)
+                D[rows, rows + i0] = -1
+            vals, idx = torch.topk(D, k, dim=1, largest=False, sorted=True)
+            del D
+            vals.clamp_min_(0)
+            if metric == "euclidean":
+                vals.sqrt_()
+            indices[i0:i1] = idx.cpu().numpy()
+            dists[i0:i1] = vals.cpu().numpy()
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+    return indices, dists
+
+def compute_knn(X: np.ndarray, n_neighbors: int = 15, metric: str = "euclidean", cores: int = 4, seed: int = -1,
+                method: str = "nndescent", verbose: int = 0):
+    """
+    k-nearest-neighbor graph: approximate with NN-descent, as UMAP builds it, or exact with `exact_knn_torch`.
+
+    Args:
+        X: Matrix of shape (samples, features), e.g. PC scores.
+        n_neighbors: Number of neighbors per sample (including the sample itself).
+        metric: Distance metric supported by umap-learn.
+        cores: Number of threads.
+        seed: Random seed for the search; -1 for none.
+        method: "nndescent" or "exact".
+
+    Returns:
+        Tuple of (indices, distances), each of shape (samples, n_neighbors).
+    """
+    if method == "exact":
+        return exact_knn_torch(X, n_neighbors, metric, cores=cores, verbose=verbose)
+    if method != "nndescent":
+        raise ValueError(f"unknown kNN method '{method}'; use 'nndescent' or 'exact'")
+    from sklearn.utils import check_random_state
+    from umap.umap_ import nearest_neighbors
+    indices, dists, _ = nearest_neighbors(X, n_neighbors, metric, {}, False, check_random_state(None if seed == -1 else seed),
+                                          n_jobs=cores, verbose=verbose == 1)
+    return indices, dists
+
+def get_knn(X: np.ndarray, n_neighbors: int = 15, metric: str = "euclidean", cores: int = 4, seed: int = -1,
+            method: str = "nndescent", cache_dir: str = None, cache_size: int = 8, verbose: int = 0):
+    """
+    k-nearest-neighbor graph of X, read from the cache in `cache_dir` when available.
+
+    Args:
+        X: Matrix of shape (samples, features).
+        n_neighbors: Number of neighbors per sample.
+        metric: Distance metric.
+        cores: Number of threads for the search.
+        seed: Random seed for the search; -1 for none.
+        method: "nndescent" or "exact" (see `compute_knn`).
+        cache_dir: Directory of the cache; None computes the graph without caching.
+        cache_size: Largest number of graphs kept in the cache.
+
+    Returns:
+        Tuple of (indices, distances), each of shape (samples, n_neighbors).
+    """
+    if cache_dir is None:
+        return compute_knn(X, n_neighbors, metric, cores=cores, seed=seed, method=method, verbose=verbose)
+    cache = KNNCache(cache_dir, max_entries=cache_size)
+    key = data_hash(X)
+    #NN-descent graphs depend on the seed and the number of threads; the exact search does not
+    tag = f"{metric}-{method}" if method == "exact" else f"{metric}-{method}-s{seed}-t{cores}"
+    knn = cache.get(key, tag, n_neighbors)
+    if knn is not None:
+        if verbose == 1:
+            print(f"Using cached {n_neighbors}-nearest-neighbor graph")
+        return knn
+    indices, dists = compute_knn(X, n_neighbors, metric, cores=cores, seed=seed, method=method, verbose=verbose)
+    cache.put(key, tag, indices, dists)
+    return indices, dists
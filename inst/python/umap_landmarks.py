@@ -0,0 +1,137 @@
+import numpy as np
+import torch
+from torch_utils import as_tensor, get_device
+
+#candidate rows per landmark for k-means++ seeding
+POOL_FACTOR = 4
+#rows assigned to the strata at a time
+BLOCK_ROWS = 65_536
+
+def _kmeanspp(P: torch.Tensor, k: int, generator: torch.Generator) -> torch.Tensor:
+    #D^2 sampling: each new center is drawn with probability proportional to its squared distance to the closest center
+    n = P.shape[0]
+    chosen = torch.empty(k, dtype=torch.long)
+    chosen[0] = torch.randint(n, (1,), generator=generator)
+    d2 = ((P - P[chosen[0]]) ** 2).sum(dim=1)
+    for i in range(1, k):
+        total = d2.sum()
+        if total > 0:
+            chosen[i] = torch.multinomial((d2 / total).cpu(), 1, generator=generator)
+        else:
+            #every candidate sits on a center (duplicates); fill up at random
+            chosen[i] = torch.randint(n, (1,), generator=generator)
+        d2 = torch.minimum(d2, ((P - P[chosen[i]]) ** 2).sum(dim=1))
+    return chosen
+
+def _allocate(counts: np.ndarray, n_landmarks: int) -> np.ndarray:
+    #proportional allocation with at least one landmark per non-empty stratum, rounded by largest remainder
+    share = n_landmarks * counts / counts.sum()
+    quota = np.minimum(counts, np.maximum(np.floor(share), counts > 0)).astype(np.int64)
+    order = np.argsort(-(share - np.floor(share)), kind="stable")
+    while quota.sum() < n_landmarks:
+        room = order[quota[order] < counts[order]]
+        quota[room[:n_landmarks - quota.sum()]] += 1
+    while quota.sum() > n_landmarks:
+        quota[np.argmax(quota)] -= 1
+    return quota
+
+@torch.no_grad()
+def select_landmarks(X: np.ndarray, n_landmarks: int, method: str = "kmeans++", seed: int = -1, cores: int = 4,
+                     device: str = "cpu") -> np.ndarray:
+    """
+    Picks the rows UMAP is fitted on in landmark mode.
+
+    "random" draws the rows uniformly. "kmeans++" seeds k-means++ (D^2 sampling) on a random pool
+    of `POOL_FACTOR` candidates per landmark, so sparse regions and small populations get more
+    landmarks than their share of the rows; the cost is O(pool * n_landmarks * PCs) and does not
+    grow with the number of rows. "stratified" clusters a sample of the rows into about
+    sqrt(n_landmarks) strata (k-means++ and a few Lloyd iterations), assigns every row to a
+    stratum in blocks, and draws each stratum's share of the landmarks (at least one) uniformly
+    from it, so the landmarks follow the density of the data without missing small clusters.
+    Distances are Euclidean.
+
+    Args:
+        X: Matrix of shape (samples, features), e.g. PC scores.
+        n_landmarks: Number of rows to pick.
+        method: "kmeans++", "stratified" or "random".
+        seed: Random seed; -1 for none.
+        cores: Number of CPU threads.
+        device: "CPU" or "GPU".
+
+    Returns:
+        Sorted row indices of the landmarks.
+    """
+    n = X.shape[0]
+    n_landmarks = int(n_landmarks)
+    if n_landmarks >= n:
+        return np.arange(n)
+    rng = np.random.default_rng(None if seed == -1 else seed)
+    if method == "random":
+        return np.sort(rng.choice(n, n_landmarks, replace=False))
+    if method not in ("kmeans++", "stratified"):
+        raise ValueError(f"unknown landmark method '{method}'; use 'kmeans++', 'stratified' or 'random'")
+    device = get_device(device, cores)
+    generator = torch.Generator().manual_seed(int(rng.integers(2 ** 62)))
+    A = as_tensor(X, verbose=False)
+
+    if method == "kmeans++":
+        pool = np.sort(rng.choice(n, min(n, POOL_FACTOR * n_landmarks), replace=False))
+        P = A[torch.from_numpy(pool)].to(device)
+        chosen = _kmeanspp(P, n_landmarks, generator)
+        return np.sort(pool[chosen.numpy()])
+
+    n_strata = max(2, int(np.sqrt(n_landmarks)))
+    sample = np.sort(rng.choice(n, min(n, 50 * n_strata), replace=False))
+    S = A[torch.from_numpy(sample)].to(device)
+    centers = S[_kmeanspp(S, n_strata, generator).to(device)]
+    for _ in range(5):
+        labels = torch.cdist(S, centers).argmin(dim=1)
+        sums = torch.zeros_like(centers).index_add_(0, labels, S)
+        sizes = torch.bincount(labels, minlength=n_strata).unsqueeze(1)
+        #empty clusters keep their center
+        centers = torch.where(sizes > 0, sums / sizes.clamp_min(1), centers)
+    labels = np.empty(n, dtype=np.int64)
+    for i0 in range(0, n, BLOCK_ROWS):
+        block = A[i0:i0 + BLOCK_ROWS].to(device=device, dtype=centers.dtype)
+        labels[i0:i0 + BLOCK_ROWS] = torch.cdist(block, centers).argmin(dim=1).cpu().numpy()
+    counts = np.bincount(labels, minlength=n_strata)
+    quota = _allocate(counts, n_landmarks)
+    #rows grouped by stratum
+    order = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    picked = [rng.choice(order[starts[s]:starts[s + 1]], quota[s], replace=False) for s in range(n_strata) if quota[s] > 0]
+    return np.sort(np.concatenate(picked))
+
+def place_points(model, X: np.ndarray, rows: np.ndarray, placement: str = "transform", chunk_rows: int = 10_000,
+                 cores: int = 4, seed: int = -1, verbose: int = 0) -> np.ndarray:
+    """
+    Embeds the rows of X that are not landmarks into a landmark `UMAPModel`, `chunk_rows` at a time.
+
+    "transform" places them as `UMAPModel.transform` does (neighbor-weighted start and a short
+    optimization against the landmark layout); "interpolate" stops at the fuzzy-membership weighted
+    mean of the nearest landmarks' coordinates, with no optimization. Only one chunk of X is copied
+    at a time.
+
+    Args:
+        model: `UMAPModel` fitted on the landmarks.
+        X: Full matrix (samples x PCs).
+        rows: Indices of the rows to place.
+        placement: "transform" or "interpolate".
+        chunk_rows: Rows placed per chunk.
+
+    Returns:
+        NumPy array of shape (len(rows), n_components).
+    """
+    if placement not in ("transform", "interpolate"):
+        raise ValueError(f"unknown landmark placement '{placement}'; use 'transform' or 'interpolate'")
+    m = len(rows)
+    #epochs as for one call on all rows, so the result does not depend on chunk_rows
+    n_epochs = 0 if placement == "interpolate" else (100 if m <= 10000 else 30)
+    chunk_rows = max(1, int(chunk_rows))
+    out = np.empty((m, model.embedding.shape[1]), dtype=np.float32)
+    for i0 in range(0, m, chunk_rows):
+        i1 = min(i0 + chunk_rows, m)
+        if verbose == 1:
+            print(f"Placing samples {i0 + 1}-{i1} of {m}")
+        out[i0:i1] = model.transform(X[rows[i0:i1]], chunk_rows=chunk_rows, cores=cores, seed=seed, n_epochs=n_epochs)
+    return out
@@ -0,0 +1,166 @@
+import numba
+import numpy as np
+import scipy.sparse
+from umap.umap_ import (DISCONNECTION_DISTANCES, INT32_MAX, INT32_MIN, compute_membership_strengths,
+                        init_graph_transform, smooth_knn_dist)
+from umap_knn import EXACT_METRICS, exact_knn_torch
+from umap_reproducible import optimize_layout_reproducible
+
+class UMAPModel:
+    """
+    A fitted UMAP embedding that places new samples without refitting.
+
+    Keeps what `transform` needs and nothing else: the training PC scores (the search index of the
+    exact kNN engine), for other metrics their kNN graph (used to rebuild an NN-descent index
+    without a new search), the embedding and the layout parameters. The model is saved as one
+    compressed `.npz` file in single precision, a fraction of the size of a pickled umap.UMAP.
+
+    New samples are placed as umap-learn's `transform` does: their neighbors among the training
+    samples give fuzzy membership weights, the weighted mean of the neighbors' coordinates is the
+    starting point, and a short optimization moves only the new samples against the fixed layout.
+    Every new sample is handled independently, so they are processed in chunks of rows, in parallel
+    and reproducibly for a given seed. With the exact search (euclidean, cosine, correlation) the
+    result does not depend on the chunk size; NN-descent queries draw from one random stream per
+    chunk, so for other metrics the approximate neighbors can change slightly with it.
+    """
+    def __init__(self, data, embedding, knn_indices=None, knn_dists=None, metric: str = "euclidean",
+                 n_neighbors: int = 15, a: float = 1.577, b: float = 0.895, local_connectivity: float = 1.0,
+                 repulsion_strength: float = 1.0, initial_alpha: float = 1.0, negative_sample_rate: float = 5.0):
+        self.data = np.ascontiguousarray(data, dtype=np.float32)
+        self.embedding = np.ascontiguousarray(embedding, dtype=np.float32)
+        self.knn_indices = None if knn_indices is None else np.asarray(knn_indices, dtype=np.int32)
+        self.knn_dists = None if knn_dists is None else np.asarray(knn_dists, dtype=np.float32)
+        self.metric = str(metric)
+        self.n_neighbors = int(n_neighbors)
+        self.a, self.b = float(a), float(b)
+        self.local_connectivity = float(local_connectivity)
+        self.repulsion_strength = float(repulsion_strength)
+        self.initial_alpha = float(initial_alpha)
+        self.negative_sample_rate = float(negative_sample_rate)
+        #NN-descent index for metrics without an exact engine, built on first use
+        self._search_index = None
+
+    @classmethod
+    def from_umap(cls, model, data, knn_indices=None, knn_dists=None):
+        """
+        Builds a model from a fitted umap.UMAP and its training data.
+        """
+        if model.metric in EXACT_METRICS:
+            #the exact search needs only the scores
+            knn_indices = knn_dists = None
+        return cls(data, model.embedding_, knn_indices, knn_dists, metric=model.metric,
+                   n_neighbors=model._n_neighbors, a=model._a, b=model._b,
+                   local_connectivity=model.local_connectivity, repulsion_strength=model.repulsion_strength,
+                   initial_alpha=model._initial_alpha, negative_sample_rate=model.negative_sample_rate)
+
+    def save(self, path):
+        """
+        Saves the model to a compressed `.npz` file.
+        """
+        arrays = dict(data=self.data, embedding=self.embedding, metric=np.array(self.metric),
+                      params=np.array([self.n_neighbors, self.a, self.b, self.local_connectivity,
+                                       self.repulsion_strength, self.initial_alpha, self.negative_sample_rate]))
+        if self.knn_indices is not None:
+            arrays["knn_indices"] = self.knn_indices
+            arrays["knn_dists"] = self.knn_dists
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a model written by `save`.
+        """
+        with np.load(path) as f:
+            n_neighbors, a, b, local_connectivity, repulsion_strength, initial_alpha, negative_sample_rate = f["params"]
+            return cls(f["data"], f["embedding"], f["knn_indices"] if "knn_indices" in f.files else None,
+                       f["knn_dists"] if "knn_dists" in f.files else None, metric=str(f["metric"]),
+                       n_neighbors=int(n_neighbors), a=a, b=b, local_connectivity=local_connectivity,
+                       repulsion_strength=repulsion_strength, initial_alpha=initial_alpha,
+                       negative_sample_rate=negative_sample_rate)
+
+    def _neighbors(self, new_data, cores: int, seed: int):
+        if self.metric in EXACT_METRICS:
+            return exact_knn_torch(self.data, self.n_neighbors, self.metric, cores=cores, queries=new_data)
+        if self._search_index is None:
+            from pynndescent import NNDescent
+            #the stored graph seeds NN-descent, so the index is ready after a few refinement passes
+            self._search_index = NNDescent(self.data, metric=self.metric, n_neighbors=self.n_neighbors,
+                                           init_graph=self.knn_indices, init_dist=self.knn_dists,
+                                           random_state=None if seed == -1 else seed, n_jobs=cores)
+        epsilon = 0.24 if self._search_index._angular_trees else 0.12
+        return self._search_index.query(new_data, self.n_neighbors, epsilon=epsilon)
+
+    def transform(self, new_data, chunk_rows: int = 10_000, cores: int = 4, seed: int = -1, n_epochs: int = None,
+                  verbose: int = 0):
+        """
+        Embeds new samples into the fitted layout, `chunk_rows` rows at a time.
+
+        Args:
+            new_data: New PC scores (samples x the PCs the model was fitted on).
+            chunk_rows: Rows placed per chunk; memory is O(chunk_rows * training samples) for the exact search.
+            cores: Number of threads for the neighbor search and the optimization.
+            seed: Random seed for the negative sampling; -1 for none.
+            n_epochs: Optimization epochs; default 100 (30 for more than 10000 new samples), as umap-learn.
+
+        Returns:
+            NumPy array of shape (samples, n_components).
+        """
+        new_data = np.asarray(new_data)
+        if new_data.ndim != 2 or new_data.shape[1] != self.data.shape[1]:
+            raise ValueError(f"new data must have {self.data.shape[1]} columns, as the fitted PC scores")
+        m = new_data.shape[0]
+        chunk_rows = max(1, int(chunk_rows))
+        if n_epochs is None:
+            n_epochs = 100 if m <= 10000 else 30
+        #one seed for every chunk: each sample's stream also depends on its starting point, not on its chunk
+        rng = np.random.RandomState(None if seed == -1 else seed)
+        rng_state = rng.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
+        disconnection = DISCONNECTION_DISTANCES.get(self.metric, np.inf)
+        numba.set_num_threads(max(1, min(int(cores), numba.config.NUMBA_NUM_THREADS)))
+
+        out = np.empty((m, self.embedding.shape[1]), dtype=np.float32)
+        for i0 in range(0, m, chunk_rows):
+            i1 = min(i0 + chunk_rows, m)
+            if verbose == 1:
+                print(f"Embedding samples {i0 + 1}-{i1} of {m}")
+            indices, dists = self._neighbors(new_data[i0:i1], cores, seed)
+            dists = dists.astype(np.float32, order="C")
+            indices = indices.astype(np.int32)
+            indices[dists >= disconnection] = -1
+            sigmas, rhos = smooth_knn_dist(dists, float(self.n_neighbors),
+                                           local_connectivity=float(max(0.0, self.local_connectivity - 1.0)))
+            rows, cols, vals, _ = compute_membership_strengths(indices, dists, sigmas, rhos, bipartite=True)
+            graph = scipy.sparse.coo_matrix((vals, (rows, cols)), shape=(i1 - i0, self.data.shape[0]))
+            csr_graph = graph.tocsr()
+            csr_graph.eliminate_zeros()
+            embedding = init_graph_transform(csr_graph, self.embedding)
+
+            if n_epochs == 0:
+                out[i0:i1] = embedding
+                continue
+            #umap-learn scales by the largest weight of the batch; the largest possible weight (1) keeps chunks independent
+            graph.data[graph.data < 1.0 / n_epochs] = 0.0
+            graph.eliminate_zeros()
+            epochs_per_sample = 1.0 / graph.data.astype(np.float64)
+            out[i0:i1] = optimize_layout_reproducible(
+                np.ascontiguousarray(embedding, dtype=np.float32), graph.row, graph.col, n_epochs, epochs_per_sample,
+                self.a, self.b, rng_state, gamma=self.repulsion_strength, initial_alpha=self.initial_alpha / 4.0,
+                negative_sample_rate=self.negative_sample_rate, tail_embedding=self.embedding)
+        return out
+
+def umap_transform_py(model_path: str, new_data: np.ndarray, chunk_rows: int = 10_000, cores: int = 4, seed: int = -1,
+                      verbose: int = 0):
+    """
+    Embeds new PC scores into a UMAP model saved by `umap_learn_py(model_path = ...)`.
+
+    Args:
+        model_path: Path of the saved `UMAPModel`.
+        new_data: New PC scores (samples x PCs), computed with the same PCA as the fitted scores.
+        chunk_rows: Rows placed per chunk.
+        cores: Number of threads.
+        seed: Random seed; -1 for none.
+
+    Returns:
+        NumPy array of shape (samples, n_components).
+    """
+    return UMAPModel.load(model_path).transform(new_data, chunk_rows=chunk_rows, cores=cores, seed=seed, verbose=verbose)
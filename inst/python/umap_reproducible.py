@@ -0,0 +1,199 @@
+import numba
+import numpy as np
+import umap
+from umap.layouts import clip, rdist, _optimize_layout_euclidean_densmap_epoch_init
+from umap.umap_ import INT32_MAX, INT32_MIN, make_epochs_per_sample, simplicial_set_embedding
+from umap.utils import tau_rand_int
+
+@numba.njit(fastmath=True, parallel=True)
+def _reproducible_epoch(head_embedding, tail_embedding, indptr, tail, n_vertices, epochs_per_sample, a, b,
+                        rng_state_per_sample, gamma, dim, alpha, attraction, same_set, epochs_per_negative_sample,
+                        epoch_of_next_negative_sample, epoch_of_next_sample, n, densmap_flag, dens_phi_sum, dens_re_sum,
+                        dens_re_cov, dens_re_std, dens_re_mean, dens_lambda, dens_R, dens_mu, dens_mu_tot):
+    #one thread per vertex: it owns its row, its RNG stream and its edges, and reads every other row from the
+    #layout at the start of the epoch, so the result does not depend on the number of threads or their timing
+    for j in numba.prange(head_embedding.shape[0]):
+        current = head_embedding[j]
+        for i in range(indptr[j], indptr[j + 1]):
+            if epoch_of_next_sample[i] > n:
+                continue
+            k = tail[i]
+            other = tail_embedding[k]
+            dist_squared = rdist(current, other)
+
+            grad_cor_coeff = 0.0
+            if densmap_flag:
+                phi = 1.0 / (1.0 + a * pow(dist_squared, b))
+                dphi_term = a * b * pow(dist_squared, b - 1) / (1.0 + a * pow(dist_squared, b))
+                q_jk = phi / dens_phi_sum[k]
+                q_kj = phi / dens_phi_sum[j]
+                drk = q_jk * ((1.0 - b * (1 - phi)) / np.exp(dens_re_sum[k]) + dphi_term)
+                drj = q_kj * ((1.0 - b * (1 - phi)) / np.exp(dens_re_sum[j]) + dphi_term)
+                re_std_sq = dens_re_std * dens_re_std
+                weight_k = dens_R[k] - dens_re_cov * (dens_re_sum[k] - dens_re_mean) / re_std_sq
+                weight_j = dens_R[j] - dens_re_cov * (dens_re_sum[j] - dens_re_mean) / re_std_sq
+                grad_cor_coeff = (dens_lambda * dens_mu_tot * (weight_k * drk + weight_j * drj)
+                                  / (dens_mu[i] * dens_re_std) / n_vertices)
+
+            if dist_squared > 0.0:
+                grad_coeff = -2.0 * a * b * pow(dist_squared, b - 1.0)
+                grad_coeff /= a * pow(dist_squared, b) + 1.0
+            else:
+                grad_coeff = 0.0
+
+            for d in range(dim):
+                grad_d = clip(grad_coeff * (current[d] - other[d]))
+                if densmap_flag:
+                    grad_d += clip(2 * grad_cor_coeff * (current[d] - other[d]))
+                current[d] += attraction * grad_d * alpha
+
+            epoch_of_next_sample[i] += epochs_per_sample[i]
+
+            n_neg_samples = int((n - epoch_of_next_negative_sample[i]) / epochs_per_negative_sample[i])
+            for p in range(n_neg_samples):
+                k = tau_rand_int(rng_state_per_sample[j]) % n_vertices
+                if same_set and k == j:
+                    continue
+                other = tail_embedding[k]
+                dist_squared = rdist(current, other)
+                if dist_squared > 0.0:
+                    grad_coeff = 2.0 * gamma * b
+                    grad_coeff /= (0.001 + dist_squared) * (a * pow(dist_squared, b) + 1)
+                    for d in range(dim):
+                        current[d] += clip(grad_coeff * (current[d] - other[d])) * alpha
+
+            epoch_of_next_negative_sample[i] += n_neg_samples * epochs_per_negative_sample[i]
+
+#densMAP statistics summed in a fixed order
+_densmap_epoch_init = numba.njit(_optimize_layout_euclidean_densmap_epoch_init, fastmath=True, parallel=False)
+
+def optimize_layout_reproducible(embedding, head, tail, n_epochs, epochs_per_sample, a, b, rng_state, gamma=1.0,
+                                 initial_alpha=1.0, negative_sample_rate=5.0, densmap=False, densmap_kwds=None,
+                                 tail_embedding=None):
+    """
+    UMAP layout optimization that gives the same embedding for a given seed with any number of threads.
+
+    umap-learn's parallel SGD lets threads update shared embedding rows and RNG states as they go
+    (Hogwild), so it is not reproducible and umap-learn runs on one thread whenever a seed is set.
+    Here the edges are grouped by head vertex and each epoch updates the vertices in parallel
+    against a copy of the layout from the start of the epoch (chunk-partitioned, Jacobi-style
+    updates): a vertex only moves its own row, draws negative samples from its own seeded RNG
+    stream, and reads its neighbors from the copy. The attraction along an edge is applied to the
+    head twice, since the symmetric graph moves the tail separately through the reverse edge.
+
+    With `tail_embedding`, new samples (`embedding`) are placed against a fixed fitted layout
+    instead, as in umap-learn's `transform`: only the heads move, once per edge.
+
+    Args:
+        embedding: Initial layout (float32, samples x n_components); updated in place.
+        head, tail: Edges of the pruned fuzzy graph.
+        n_epochs: Number of epochs.
+        epochs_per_sample: From `umap.umap_.make_epochs_per_sample`, in the order of the edges.
+        a, b: Curve parameters of the low-dimensional similarities.
+        rng_state: Seed of the per-vertex RNG streams (3 int64).
+        densmap_kwds: umap-learn's densMAP parameters, with `mu` in the order of the edges.
+        tail_embedding: Fixed layout the tails index into; None when fitting (tails are the samples of `embedding`).
+
+    Returns:
+        The optimized layout.
+    """
+    fit = tail_embedding is None
+    n_heads = embedding.shape[0]
+    n_vertices = n_heads if fit else tail_embedding.shape[0]
+    dim = embedding.shape[1]
+    #group edges by head vertex (stable, so the order within a vertex is that of the graph)
+    order = np.argsort(head, kind="stable")
+    head = np.ascontiguousarray(head[order])
+    tail = np.ascontiguousarray(tail[order])
+    epochs_per_sample = np.ascontiguousarray(epochs_per_sample[order])
+    indptr = np.zeros(n_heads + 1, dtype=np.int64)
+    np.cumsum(np.bincount(head, minlength=n_heads), out=indptr[1:])
+
+    epochs_per_negative_sample = epochs_per_sample / negative_sample_rate
+    epoch_of_next_negative_sample = epochs_per_negative_sample.copy()
+    epoch_of_next_sample = epochs_per_sample.copy()
+
+    if densmap:
+        dens_mu_tot = np.sum(densmap_kwds["mu_sum"]) / 2
+        dens_lambda = densmap_kwds["lambda"]
+        dens_R = densmap_kwds["R"]
+        dens_mu = np.ascontiguousarray(densmap_kwds["mu"][order])
+        dens_phi_sum = np.zeros(n_vertices, dtype=np.float32)
+        dens_re_sum = np.zeros(n_vertices, dtype=np.float32)
+        dens_var_shift = densmap_kwds["var_shift"]
+    else:
+        dens_mu_tot = 0
+        dens_lambda = 0
+        dens_R = np.zeros(1, dtype=np.float32)
+        dens_mu = np.zeros(1, dtype=np.float32)
+        dens_phi_sum = np.zeros(1, dtype=np.float32)
+        dens_re_sum = np.zeros(1, dtype=np.float32)
+
+    #same per-vertex streams as umap-learn
+    rng_state_per_sample = np.full((n_heads, len(rng_state)), rng_state, dtype=np.int64) + \
+        embedding[:, 0].astype(np.float64).view(np.int64).reshape(-1, 1)
+
+    previous = np.empty_like(embedding) if fit else tail_embedding
+    #the symmetric graph also holds (k, j); umap-learn moves j along that edge too (move_other)
+    attraction = 2.0 if fit else 1.0
+    alpha = initial_alpha
+    for n in range(n_epochs):
+        densmap_flag = densmap and dens_lambda > 0 and ((n + 1) / float(n_epochs)) > (1 - densmap_kwds["frac"])
+        if densmap_flag:
+            _densmap_epoch_init(embedding, embedding, head, tail, a, b, dens_re_sum, dens_phi_sum)
+            dens_re_std = np.sqrt(np.var(dens_re_sum) + dens_var_shift)
+            dens_re_mean = np.mean(dens_re_sum)
+            dens_re_cov = np.dot(dens_re_sum, dens_R) / (n_vertices - 1)
+        else:
+            dens_re_std = 0
+            dens_re_mean = 0
+            dens_re_cov = 0
+        if fit:
+            previous[:] = embedding
+        _reproducible_epoch(embedding, previous, indptr, tail, n_vertices, epochs_per_sample, a, b,
+                            rng_state_per_sample, gamma, dim, alpha, attraction, fit, epochs_per_negative_sample,
+                            epoch_of_next_negative_sample, epoch_of_next_sample, n, densmap_flag, dens_phi_sum,
+                            dens_re_sum, dens_re_cov, dens_re_std, dens_re_mean, dens_lambda, dens_R, dens_mu,
+                            dens_mu_tot)
+        alpha = initial_alpha * (1.0 - (float(n) / float(n_epochs)))
+    return embedding
+
+class ReproducibleUMAP(umap.UMAP):
+    """
+    umap.UMAP with a seeded layout optimization that runs on `layout_threads` threads and still
+    gives the same embedding on every run (see `optimize_layout_reproducible`).
+
+    umap-learn sets n_jobs to 1 whenever `random_state` is given; with a precomputed kNN graph
+    the layout is the only other parallel step, and it is replaced here. The initialization,
+    graph pruning and densMAP weights are left to umap-learn.
+    """
+    def __init__(self, layout_threads: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.layout_threads = layout_threads
+
+    def _fit_embed_data(self, X, n_epochs, init, random_state, **kwargs):
+        #umap-learn's own layout for custom epochs or output metrics
+        if n_epochs is not None or self.output_metric not in ("euclidean", "l2"):
+            return super()._fit_embed_data(X, n_epochs, init, random_state, **kwargs)
+        graph = self.graph_.tocoo(copy=True)
+        graph.sum_duplicates()
+        n_epochs = (500 if graph.shape[0] <= 10000 else 200) + (200 if self.densmap else 0)
+        #umap-learn prepares the initial layout and densMAP weights (and prunes its copy of the graph the same
+        #way as below) without optimizing: a list of epochs returns the layout before the first epoch
+        embedding, aux_data = simplicial_set_embedding(
+            X, self.graph_, self.n_components, self._initial_alpha, self._a, self._b, self.repulsion_strength,
+            self.negative_sample_rate, [0], init, random_state, self._input_distance_func, self._metric_kwds,
+            self.densmap, self._densmap_kwds, self.output_dens, self._output_distance_func,
+            self._output_metric_kwds, True, False, self.verbose, tqdm_kwds=self.tqdm_kwds)
+        aux_data.pop("embedding_list", None)
+        graph.data[graph.data < (graph.data.max() / float(n_epochs))] = 0.0
+        graph.eliminate_zeros()
+        epochs_per_sample = make_epochs_per_sample(graph.data, n_epochs)
+        rng_state = random_state.randint(INT32_MIN, INT32_MAX, 3).astype(np.int64)
+
+        numba.set_num_threads(max(1, min(int(self.layout_threads), numba.config.NUMBA_NUM_THREADS)))
+        embedding = optimize_layout_reproducible(
+            np.ascontiguousarray(embedding, dtype=np.float32), graph.row, graph.col, n_epochs, epochs_per_sample,
+            self._a, self._b, rng_state, gamma=self.repulsion_strength, initial_alpha=self._initial_alpha,
+            negative_sample_rate=self.negative_sample_rate, densmap=self.densmap, densmap_kwds=self._densmap_kwds)
+        return embedding, aux_data